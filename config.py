@@ -21,6 +21,33 @@ BALL_SPEED_MAX = 560.0
 BALL_SPEED_INC_ON_HIT = 12.0
 BALL_ANGLE_MAX_DEG = 60  # limita desvio vertical ao rebater
 
+# Recuos em relação à borda do rink (px)
+GOAL_X_INSET = 40     # linha de gol (boca da goleira)
+PADDLE_X_INSET = 80   # paddles
+NET_DEPTH = 30        # espaço atrás da goleira antes da parede do fundo
+
+# Perfis de regras por partida: cada um sobrescreve os valores acima.
+# São validados uma única vez ao iniciar o servidor (geometria.load_profiles).
+PROFILES = {
+    "padrao": {},
+    "rapido": {
+        "paddle_speed": 380.0,
+        "ball_speed": 420.0,
+        "ball_speed_max": 720.0,
+        "game_time": 120,
+    },
+    "grande": {
+        "width": 1024,
+        "height": 600,
+        "goal_h": 150,
+        "paddle_h": 50,
+        "paddle_speed": 360.0,
+        "ball_speed": 380.0,
+        "ball_speed_max": 640.0,
+    },
+}
+DEFAULT_PROFILE = "padrao"
+
 # Cores
 COLOR_BG = (48, 48, 54)
 COLOR_FIELD_BORDER = (220, 220, 220)
@@ -37,3 +64,39 @@ COLOR_TIME = (180, 220, 255)
 COLOR_ME = (200, 255, 200)
 COLOR_GAMEOVER = (255, 120, 120)
 COLOR_WINNER = (255, 220, 220)
+COLOR_DEBUG = (170, 255, 170)
+
+# Rede / latência
+PING_INTERVAL = 0.5      # s entre pings (cliente e servidor)
+RTT_ALPHA = 0.125        # peso da nova amostra no RTT suavizado
+RTT_BETA = 0.25          # peso da nova amostra na variação do RTT
+OFFSET_ALPHA = 0.1       # peso da nova amostra na diferença de relógio
+METRICS_INTERVAL = 5.0   # s entre exportações de métricas do servidor
+
+# Taxa adaptativa de snapshots (por cliente)
+SNAPSHOT_RATE_MIN = 10           # Hz, piso para clientes congestionados
+SNAPSHOT_RATE_MAX = None         # Hz, teto opcional; None = um snapshot por tick da partida
+SNAPSHOT_RATE_STEP = 5           # Hz somados a cada janela sem congestionamento
+SNAPSHOT_RATE_BACKOFF = 0.7      # fator aplicado à taxa quando há congestionamento
+SNAPSHOT_QUEUE_MAX_DELAY = 0.1   # s de fila (bytes / vazão) tolerados antes de reduzir
+SNAPSHOT_RTT_SLACK = 0.08        # s de RTT acima do mínimo tolerados antes de reduzir
+RATE_ADAPT_INTERVAL = 0.5        # s entre reavaliações da taxa
+SEND_BUFFER_MAX = 256 * 1024     # bytes pendentes antes de considerar o cliente morto
+
+# Reconexão
+CONNECTION_TIMEOUT = 3.0         # s sem receber nada antes de considerar a conexão perdida
+RECONNECT_GRACE_SECONDS = 20.0   # s que o servidor segura a vaga de quem caiu
+PAUSE_ON_DISCONNECT = True       # pausa a partida durante a espera (False: segue com input neutro)
+RECONNECT_RETRY_INTERVAL = 0.5   # s entre tentativas de reconexão do cliente
+
+# Lobby / partidas
+GAME_OVER_COOLDOWN = 7.0         # s mostrando o placar final antes de fechar a partida
+
+# Modos de rede
+MODE_SERVER = "servidor"         # servidor autoritativo simula e manda snapshots
+MODE_ROLLBACK = "rollback"       # clientes simulam; servidor só repassa e valida inputs
+DEFAULT_MODE = MODE_SERVER
+ROLLBACK_INPUT_DELAY = 2         # frames entre ler a tecla e aplicá-la
+ROLLBACK_MAX_FRAMES = 8          # máximo de frames previstos à frente do último input remoto
+ROLLBACK_CHECKSUM_INTERVAL = 30  # frames entre checksums enviados ao servidor
+ROLLBACK_INPUT_SLACK = 30        # frames que um cliente pode estar à frente do relógio do servidor
@@ -0,0 +1,323 @@
+import math
+import random
+import struct
+import zlib
+
+# Simulação do jogo: estado e passo de física, usados pelo servidor (modo servidor)
+# e pelos clientes (modo rollback). Tudo aqui depende só do estado, dos inputs e
+# do Geometry, para que a mesma sequência de inputs produza o mesmo resultado.
+
+# Inputs compactos (modo rollback): bit 0 = cima, bit 1 = baixo
+KEYS_FROM_BITS = (
+    {"up": False, "down": False},
+    {"up": True, "down": False},
+    {"up": False, "down": True},
+    {"up": True, "down": True},
+)
+
+def keys_to_bits(keys):
+    return (1 if keys.get("up") else 0) | (2 if keys.get("down") else 0)
+
+_STATE_PACK = struct.Struct("!6d3q")
+
+# Checksum de um estado salvo (GameState.save), para detectar dessincronização entre clientes
+def state_checksum(saved):
+    return zlib.crc32(_STATE_PACK.pack(*saved))
+
+# --------- Estado ---------
+class GameState:
+    def __init__(self, geo, seed):
+        self.geo = geo
+        self.seed = seed
+        self.reset_full()
+
+    def reset_full(self):
+        geo = self.geo
+        self.p1_y = geo.paddle_y_start
+        self.p2_y = geo.paddle_y_start
+        self.score1 = 0
+        self.score2 = 0
+        self.ball_x = geo.center_x
+        self.ball_y = geo.center_y
+        # Sentido do saque sorteado pela semente da partida (reprodutível nos dois clientes)
+        self.ball_vx = geo.ball_speed if random.Random(self.seed).getrandbits(1) else -geo.ball_speed
+        self.ball_vy = 0.0
+        self.game_started_at = None
+        self.game_over = False
+        self.paused = False
+        self.paused_time = 0.0  # s pausados (não contam no relógio da partida)
+        self.tick = 0
+
+    def reset_ball(self, to_left: bool):
+        self.ball_x = self.geo.center_x
+        self.ball_y = self.geo.center_y
+        self.ball_vx = -self.geo.ball_speed if to_left else self.geo.ball_speed
+        self.ball_vy = 0.0
+
+    # Cópia/restauração rápida do estado simulado (usada no rollback); relógio e
+    # pausa da partida ficam de fora porque não fazem parte da simulação
+    def save(self):
+        return (self.p1_y, self.p2_y, self.ball_x, self.ball_y, self.ball_vx, self.ball_vy,
+                self.score1, self.score2, self.tick)
+
+    def load(self, saved):
+        (self.p1_y, self.p2_y, self.ball_x, self.ball_y, self.ball_vx, self.ball_vy,
+         self.score1, self.score2, self.tick) = saved
+
+    def snapshot(self, remaining, server_time):
+        return {
+            "type": "state",
+            "tick": self.tick,
+            "server_time": server_time,
+            "ball": {"x": self.ball_x, "y": self.ball_y},
+            "p1": {"y": self.p1_y},
+            "p2": {"y": self.p2_y},
+            "score": {"p1": self.score1, "p2": self.score2},
+            "time": max(0, int(remaining)),
+            "game_over": self.game_over,
+            "paused": self.paused,
+        }
+
+# --------- Utilidades ---------
+def clamp(v, lo, hi):
+    return max(lo, min(hi, v))
+
+def paddle_rect(x_left, y_top, geo):
+    return (x_left, y_top, geo.paddle_w, geo.paddle_h)
+
+def aabb_overlap(ax, ay, aw, ah, bx, by, bw, bh):
+    return (ax < bx + bw and ax + aw > bx and ay < by + bh and ay + ah > by)
+
+# --------- Física ---------
+# Avança a simulação em dt segundos; inputs é [p1, p2] com {"up", "down"}
+def step_physics(state, inputs, dt, geo):
+    # Mover paddles (vaga desconectada fica com input neutro)
+    dy1 = (geo.paddle_speed * dt) * (-1 if inputs[0]["up"] else (1 if inputs[0]["down"] else 0))
+    dy2 = (geo.paddle_speed * dt) * (-1 if inputs[1]["up"] else (1 if inputs[1]["down"] else 0))
+    state.p1_y = clamp(state.p1_y + dy1, geo.paddle_y_min, geo.paddle_y_max)
+    state.p2_y = clamp(state.p2_y + dy2, geo.paddle_y_min, geo.paddle_y_max)
+
+    # Mover bola
+    prev_x = state.ball_x
+    prev_y = state.ball_y
+
+    state.ball_x += state.ball_vx * dt
+    state.ball_y += state.ball_vy * dt
+
+    # Colisão com teto/solo
+    top = geo.rink_top
+    bottom = geo.rink_bottom
+    if state.ball_y - geo.ball_r < top:
+        state.ball_y = top + geo.ball_r
+        state.ball_vy *= -1
+    elif state.ball_y + geo.ball_r > bottom:
+        state.ball_y = bottom - geo.ball_r
+        state.ball_vy *= -1
+
+    # Colisão com paddles
+    p1x = geo.p1_x
+    p2x = geo.p2_x
+
+    # Recalcula retângulo da bola antes de cada checagem
+    ball_rect = (
+        state.ball_x - geo.ball_r,
+        state.ball_y - geo.ball_r,
+        geo.ball_size, geo.ball_size
+    )
+
+    # ---------------- Paddle 1 (esquerda) ----------------
+    p1_rect = paddle_rect(p1x, state.p1_y, geo)
+    if aabb_overlap(*p1_rect, *ball_rect):
+        # Checa se a colisão é vertical (topo/base) ou lateral (frente/trás)
+        bx, by, bw, bh = ball_rect
+        px, py, pw, ph = p1_rect
+
+        overlap_left = (bx + bw) - px
+        overlap_right = (px + pw) - bx
+        overlap_top = (by + bh) - py
+        overlap_bottom = (py + ph) - by
+
+        min_ox = min(overlap_left, overlap_right)
+        min_oy = min(overlap_top, overlap_bottom)
+
+        r = geo.ball_r
+
+        if min_oy < min_ox:
+            # --- Colisão no TOPO/BASE do paddle: reflete vy e reposiciona fora ---
+            if overlap_top < overlap_bottom:
+                # Bateu no topo do paddle
+                state.ball_y = py - r - 0.1
+                state.ball_vy = -abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else -(geo.ball_speed * 0.6)
+            else:
+                # Bateu na base do paddle
+                state.ball_y = py + ph + r + 0.1
+                state.ball_vy =  abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else  (geo.ball_speed * 0.6)
+
+            # Pequeno empurrão horizontal baseado na altura do impacto (mantém sensação de controle)
+            rel = ((state.ball_y) - (state.p1_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+            rel = clamp(rel, -1, 1)
+            state.ball_vx = clamp(state.ball_vx + rel * (geo.ball_speed_inc_on_hit * 0.2), -geo.ball_speed_max, geo.ball_speed_max)
+
+        else:
+            # --- Colisão LATERAL (frente/trás)
+            if state.ball_vx < 0:
+                # Frente (bola indo para a esquerda)
+                rel = ((state.ball_y) - (state.p1_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+                rel = clamp(rel, -1, 1)
+                ang = geo.angle_max_rad * rel
+                speed = min(math.hypot(state.ball_vx, state.ball_vy) + geo.ball_speed_inc_on_hit, geo.ball_speed_max)
+                state.ball_vx =  speed * math.cos(ang)
+                state.ball_vy =  speed * math.sin(ang)
+                state.ball_x = p1x + geo.paddle_w + r + 1
+            else:
+                # Por trás (bola indo para a direita)
+                rel = ((state.ball_y) - (state.p1_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+                rel = clamp(rel, -1, 1)
+                ang = geo.angle_max_rad * rel
+                speed = min(math.hypot(state.ball_vx, state.ball_vy) + geo.ball_speed_inc_on_hit, geo.ball_speed_max)
+                state.ball_vx = -speed * math.cos(ang)
+                state.ball_vy =  speed * math.sin(ang)
+                state.ball_x = p1x - r - 1
+
+    # Recalcula ball_rect novamente (posições podem ter mudado)
+    ball_rect = (
+        state.ball_x - geo.ball_r,
+        state.ball_y - geo.ball_r,
+        geo.ball_size, geo.ball_size
+    )
+
+    # ---------------- Paddle 2 (direita) ----------------
+    p2_rect = paddle_rect(p2x, state.p2_y, geo)
+    if aabb_overlap(*p2_rect, *ball_rect):
+        bx, by, bw, bh = ball_rect
+        px, py, pw, ph = p2_rect
+
+        overlap_left = (bx + bw) - px
+        overlap_right = (px + pw) - bx
+        overlap_top = (by + bh) - py
+        overlap_bottom = (py + ph) - by
+
+        min_ox = min(overlap_left, overlap_right)
+        min_oy = min(overlap_top, overlap_bottom)
+
+        r = geo.ball_r
+
+        if min_oy < min_ox:
+            # --- Colisão no TOPO/BASE do paddle ---
+            if overlap_top < overlap_bottom:
+                state.ball_y = py - r - 0.1
+                state.ball_vy = -abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else -(geo.ball_speed * 0.6)
+            else:
+                state.ball_y = py + ph + r + 0.1
+                state.ball_vy =  abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else  (geo.ball_speed * 0.6)
+
+            rel = ((state.ball_y) - (state.p2_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+            rel = clamp(rel, -1, 1)
+            state.ball_vx = clamp(state.ball_vx + rel * (geo.ball_speed_inc_on_hit * 0.2), -geo.ball_speed_max, geo.ball_speed_max)
+
+        else:
+            # --- Colisão LATERAL (frente/trás) ---
+            if state.ball_vx > 0:
+                # Frente (bola indo para a direita)
+                rel = ((state.ball_y) - (state.p2_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+                rel = clamp(rel, -1, 1)
+                ang = geo.angle_max_rad * rel
+                speed = min(math.hypot(state.ball_vx, state.ball_vy) + geo.ball_speed_inc_on_hit, geo.ball_speed_max)
+                state.ball_vx = -speed * math.cos(ang)
+                state.ball_vy =  speed * math.sin(ang)
+                state.ball_x = p2x - r - 1
+            else:
+                # Por trás (bola indo para a esquerda)
+                rel = ((state.ball_y) - (state.p2_y + geo.paddle_h/2)) / (geo.paddle_h/2)
+                rel = clamp(rel, -1, 1)
+                ang = geo.angle_max_rad * rel
+                speed = min(math.hypot(state.ball_vx, state.ball_vy) + geo.ball_speed_inc_on_hit, geo.ball_speed_max)
+                state.ball_vx =  speed * math.cos(ang)
+                state.ball_vy =  speed * math.sin(ang)
+                state.ball_x = p2x + pw + r + 1
+
+    # --- GOLS por CRUZAMENTO e REBATES nas goleiras ---
+    r = geo.ball_r
+
+    bx_left_prev = prev_x - r
+    bx_right_prev = prev_x + r
+    bx_left_cur = state.ball_x - r
+    bx_right_cur = state.ball_x + r
+
+    by_prev_top = prev_y - r # “topo” da bola no frame anterior
+    by_cur_top = state.ball_y - r
+    by_prev_bot = prev_y + r # “base” da bola no frame anterior
+    by_cur_bot = state.ball_y + r
+
+    scored = False
+
+    # 1) Gol à ESQUERDA: cruzou a linha pela frente e dentro da boca
+    if state.ball_vx < 0 and bx_left_prev > geo.left_goal_x_front and bx_left_cur <= geo.left_goal_x_front:
+        denom = (bx_left_prev - bx_left_cur) or 1e-9
+        t = (bx_left_prev - geo.left_goal_x_front) / denom
+        y_cross = prev_y + t * (state.ball_y - prev_y)
+        if geo.goal_y0 <= y_cross <= geo.goal_y1:
+            state.score2 += 1
+            state.reset_ball(to_left=False)
+            scored = True
+
+    # 2) Gol à DIREITA: cruzou a linha pela frente e dentro da boca
+    elif state.ball_vx > 0 and bx_right_prev < geo.right_goal_x_front and bx_right_cur >= geo.right_goal_x_front:
+        denom = (bx_right_cur - bx_right_prev) or 1e-9
+        t = (geo.right_goal_x_front - bx_right_prev) / denom
+        y_cross = prev_y + t * (state.ball_y - prev_y)
+        if geo.goal_y0 <= y_cross <= geo.goal_y1:
+            state.score1 += 1
+            state.reset_ball(to_left=True)
+            scored = True
+
+    if not scored:
+        # 3) Fundo da rede: rebate na parede de trás se entrar atrás do gol
+        if bx_left_cur <= geo.left_wall_x:
+            state.ball_vx = abs(state.ball_vx)
+            state.ball_x  = geo.left_wall_x + r + 0.1
+
+        if bx_right_cur >= geo.right_wall_x:
+            state.ball_vx = -abs(state.ball_vx)
+            state.ball_x  = geo.right_wall_x - r - 0.1
+
+        # 3b) Boca do gol: rebate quando a bola vem por trás (sem contar gol)
+        # Esquerda: bola está DENTRO (x < geo.left_goal_x_front) e cruza o plano frontal indo para fora (→)
+        if state.ball_vx > 0 and bx_left_prev < geo.left_goal_x_front and bx_left_cur >= geo.left_goal_x_front:
+            denom = (bx_left_cur - bx_left_prev) or 1e-9
+            t = (geo.left_goal_x_front - bx_left_prev) / denom
+            y_cross = prev_y + t * (state.ball_y - prev_y)
+            if geo.goal_y0 <= y_cross <= geo.goal_y1:
+                state.ball_vx = -abs(state.ball_vx)
+                state.ball_x  = geo.left_goal_x_front - r - 0.1
+
+        # Direita: bola está DENTRO (x > geo.right_goal_x_front) e cruza o plano frontal indo para fora (←)
+        if state.ball_vx < 0 and bx_right_prev > geo.right_goal_x_front and bx_right_cur <= geo.right_goal_x_front:
+            denom = (bx_right_prev - bx_right_cur) or 1e-9
+            t = (bx_right_prev - geo.right_goal_x_front) / denom
+            y_cross = prev_y + t * (state.ball_y - prev_y)
+            if geo.goal_y0 <= y_cross <= geo.goal_y1:
+                state.ball_vx =  abs(state.ball_vx)
+                state.ball_x  = geo.right_goal_x_front + r + 0.1
+
+
+        # 4) Travessão e base por CRUZAMENTO VERTICAL dentro da profundidade do gol
+        # Faixas finas centradas na linha de gol da frente (boca)
+        left_front_band_prev = (geo.left_goal_x_front - geo.post_t) <= prev_x <= (geo.left_goal_x_front + geo.post_t)
+        left_front_band_cur = (geo.left_goal_x_front - geo.post_t) <= state.ball_x <= (geo.left_goal_x_front + geo.post_t)
+        right_front_band_prev = (geo.right_goal_x_front - geo.post_t) <= prev_x <= (geo.right_goal_x_front + geo.post_t)
+        right_front_band_cur = (geo.right_goal_x_front - geo.post_t) <= state.ball_x <= (geo.right_goal_x_front + geo.post_t)
+
+        near_any_front = (left_front_band_prev or left_front_band_cur or
+                        right_front_band_prev or right_front_band_cur)
+
+        if near_any_front:
+            # Bate no TRAVESSÃO (topo da boca) só se cruzar vindo de baixo pra cima
+            if state.ball_vy < 0 and by_prev_top > geo.goal_y0 and by_cur_top <= geo.goal_y0:
+                state.ball_y = geo.goal_y0 + r + 0.1
+                state.ball_vy = abs(state.ball_vy)
+
+            # Bate na BASE da boca só se cruzar vindo de cima pra baixo
+            elif state.ball_vy > 0 and by_prev_bot < geo.goal_y1 and by_cur_bot >= geo.goal_y1:
+                state.ball_y = geo.goal_y1 - r - 0.1
+                state.ball_vy = -abs(state.ball_vy)
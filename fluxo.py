@@ -0,0 +1,166 @@
+import json
+import struct
+from config import *
+
+# Fila de envio por cliente e controle adaptativo da taxa de snapshots.
+#
+# O servidor nunca escreve direto no socket: tudo passa pela fila do ClientLink,
+# que é drenada com send() não-bloqueante. A cada RATE_ADAPT_INTERVAL a vazão
+# entregue e a profundidade da fila (usuário + kernel) são medidas e a taxa de
+# snapshots do cliente sobe (aditivo) ou desce (multiplicativo), como no TCP.
+
+try:
+    import fcntl
+    import termios
+    _TIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):
+    fcntl = None
+    _TIOCOUTQ = None
+
+DETAIL_FULL = 0     # snapshot completo, coordenadas em float
+DETAIL_REDUCED = 1  # coordenadas inteiras, placar/tempo/pausa só quando mudam
+
+
+def encode_frame(obj):
+    data = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return struct.pack("!I", len(data)) + data
+
+# Bytes ainda no buffer de envio do kernel (não confirmados); 0 se o SO não informar
+def kernel_outq(sock):
+    if fcntl is None:
+        return 0
+    try:
+        buf = fcntl.ioctl(sock.fileno(), _TIOCOUTQ, b"\0\0\0\0")
+        return struct.unpack("i", buf)[0]
+    except OSError:
+        return 0
+
+
+class ClientLink:
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.outbuf = bytearray()
+        self.snapshot_pending = 0  # bytes do último snapshot que ainda não saíram do outbuf
+
+        self.set_tick_rate(FPS)
+        self.detail = DETAIL_FULL
+        self.next_snapshot_at = now
+        self.last_meta = None  # (placar, tempo, game_over, pausa) enviado por último
+
+        # Medições da janela atual
+        self.window_start = now
+        self.window_sent = 0
+        self.window_outq = 0
+        self.throughput = None  # bytes/s entregues (EWMA)
+        self.queue_depth = 0    # bytes pendentes (fila + kernel)
+        self.snapshots_sent = 0
+        self.snapshots_dropped = 0
+
+    # Teto da taxa: um snapshot por tick da partida, limitado por SNAPSHOT_RATE_MAX se definido
+    def set_tick_rate(self, fps):
+        cap = fps if SNAPSHOT_RATE_MAX is None else min(fps, SNAPSHOT_RATE_MAX)
+        self.rate_max = float(cap)
+        self.rate = self.rate_max
+
+    # -------- Envio --------
+    def queue(self, obj):
+        self.outbuf += encode_frame(obj)
+        if len(self.outbuf) > SEND_BUFFER_MAX:
+            raise ConnectionError("Fila de envio estourou (cliente não está lendo)")
+
+    def flush(self):
+        while self.outbuf:
+            try:
+                n = self.sock.send(self.outbuf)
+            except (BlockingIOError, InterruptedError):
+                break
+            if n <= 0:
+                break
+            del self.outbuf[:n]
+            self.snapshot_pending = max(0, self.snapshot_pending - n)
+            self.window_sent += n
+
+    # -------- Snapshots --------
+    def offer_snapshot(self, snap, now):
+        if now < self.next_snapshot_at:
+            return False
+        self.next_snapshot_at = max(self.next_snapshot_at + 1.0 / self.rate, now)
+        # Se o anterior ainda nem saiu da fila, descarta: só o mais recente importa
+        # (pongs e outras mensagens pequenas na fila não contam)
+        if self.snapshot_pending:
+            self.snapshots_dropped += 1
+            return False
+        self.queue(self.shape_snapshot(snap))
+        self.snapshot_pending = len(self.outbuf)
+        self.snapshots_sent += 1
+        return True
+
+    def shape_snapshot(self, snap):
+        meta = (snap["score"]["p1"], snap["score"]["p2"], snap["time"], snap["game_over"], snap["paused"])
+        changed = meta != self.last_meta
+        self.last_meta = meta
+        if self.detail == DETAIL_FULL:
+            return snap
+
+        out = {
+            "type": "state",
+            "tick": snap["tick"],
+            "server_time": round(snap["server_time"], 4),
+            "detail": DETAIL_REDUCED,
+            "ball": {"x": round(snap["ball"]["x"]), "y": round(snap["ball"]["y"])},
+            "p1": {"y": round(snap["p1"]["y"])},
+            "p2": {"y": round(snap["p2"]["y"])},
+        }
+        if changed:
+            out["score"] = snap["score"]
+            out["time"] = snap["time"]
+            out["game_over"] = snap["game_over"]
+            out["paused"] = snap["paused"]
+        return out
+
+    # -------- Adaptação --------
+    def adapt(self, now, latency):
+        elapsed = now - self.window_start
+        if elapsed < RATE_ADAPT_INTERVAL:
+            return
+
+        outq = kernel_outq(self.sock)
+        # Entregue = enviado ao kernel menos o que ficou acumulado a mais no kernel
+        delivered = max(0, self.window_sent + self.window_outq - outq)
+        sample = delivered / elapsed
+        if self.throughput is None:
+            self.throughput = sample
+        else:
+            self.throughput += 0.25 * (sample - self.throughput)
+        self.queue_depth = len(self.outbuf) + outq
+
+        self.window_start = now
+        self.window_sent = 0
+        self.window_outq = outq
+
+        # Bytes em trânsito normais custam ~1 RTT; só o excedente é fila
+        queue_delay = self.queue_depth / max(self.throughput, 1.0) - (latency.rtt_min or 0.0)
+        rtt_inflated = (latency.rtt is not None and latency.rtt_min is not None
+                        and latency.rtt > latency.rtt_min + SNAPSHOT_RTT_SLACK)
+        congested = queue_delay > SNAPSHOT_QUEUE_MAX_DELAY or rtt_inflated
+
+        if congested:
+            if self.rate > SNAPSHOT_RATE_MIN:
+                self.rate = max(SNAPSHOT_RATE_MIN, self.rate * SNAPSHOT_RATE_BACKOFF)
+            else:
+                self.detail = DETAIL_REDUCED
+        elif self.detail != DETAIL_FULL:
+            self.detail = DETAIL_FULL
+            self.last_meta = None  # próximo snapshot completo de qualquer forma
+        else:
+            self.rate = min(self.rate_max, self.rate + SNAPSHOT_RATE_STEP)
+
+    def metrics(self):
+        return {
+            "snapshot_hz": round(self.rate, 1),
+            "detail": self.detail,
+            "throughput_bps": None if self.throughput is None else round(self.throughput),
+            "queue_bytes": self.queue_depth,
+            "snapshots_sent": self.snapshots_sent,
+            "snapshots_dropped": self.snapshots_dropped,
+        }
@@ -0,0 +1,167 @@
+import math
+from dataclasses import dataclass, field, fields
+from config import *
+
+# Regras e geometria de uma partida.
+#
+# Um Geometry é imutável e é criado uma única vez por perfil: valida os parâmetros
+# e pré-calcula tudo o que física e renderização usam (boca do gol, linhas de gol,
+# posição dos paddles...). O servidor manda os parâmetros no hello e o cliente
+# reconstrói o mesmo objeto, então os dois lados nunca divergem.
+
+@dataclass(frozen=True)
+class Geometry:
+    name: str
+    width: int
+    height: int
+    margin: int
+    paddle_w: int
+    paddle_h: int
+    goal_w: int
+    goal_h: int
+    ball_size: int
+    paddle_speed: float
+    ball_speed: float
+    ball_speed_max: float
+    ball_speed_inc_on_hit: float
+    ball_angle_max_deg: float
+    goal_x_inset: int
+    paddle_x_inset: int
+    net_depth: int
+    game_time: int
+    fps: int
+
+    # -------- Derivados (pré-calculados em __post_init__) --------
+    dt: float = field(init=False)
+    ball_r: float = field(init=False)
+    angle_max_rad: float = field(init=False)
+    rink_top: float = field(init=False)        # teto/solo da bola (5 px além da borda)
+    rink_bottom: float = field(init=False)
+    paddle_y_min: float = field(init=False)
+    paddle_y_max: float = field(init=False)
+    paddle_y_start: int = field(init=False)
+    p1_x: int = field(init=False)              # x (esquerda) dos paddles
+    p2_x: int = field(init=False)
+    center_x: int = field(init=False)
+    center_y: int = field(init=False)
+    goal_y0: int = field(init=False)           # boca do gol centralizada verticalmente
+    goal_y1: int = field(init=False)
+    left_goal_x_front: int = field(init=False)  # linha de gol colada às “paredes internas” do rink
+    right_goal_x_front: int = field(init=False)
+    left_goal_x_back: int = field(init=False)   # fundo da goleira a goal_w de profundidade
+    right_goal_x_back: int = field(init=False)
+    left_wall_x: int = field(init=False)        # parede do fundo, atrás da goleira
+    right_wall_x: int = field(init=False)
+    post_t: float = field(init=False)
+    goal_rect_left: tuple = field(init=False)   # retângulos desenhados no cliente
+    goal_rect_right: tuple = field(init=False)
+    field_rect: tuple = field(init=False)
+
+    def __post_init__(self):
+        self._validate()
+        derived = {
+            "dt": 1.0 / self.fps,
+            "ball_r": self.ball_size / 2,
+            "angle_max_rad": math.radians(self.ball_angle_max_deg),
+            "rink_top": self.margin - 5,
+            "rink_bottom": self.height - self.margin + 5,
+            "paddle_y_min": self.margin,
+            "paddle_y_max": self.height - self.margin - self.paddle_h,
+            "paddle_y_start": self.height // 2 - self.paddle_h // 2,
+            "p1_x": self.margin + self.paddle_x_inset,
+            "p2_x": self.width - self.margin - self.paddle_w - self.paddle_x_inset,
+            "center_x": self.width // 2,
+            "center_y": self.height // 2,
+            "goal_y0": self.height // 2 - self.goal_h // 2,
+            "goal_y1": self.height // 2 + self.goal_h // 2,
+            "left_goal_x_front": self.margin + self.goal_x_inset,
+            "right_goal_x_front": self.width - self.margin - self.goal_x_inset,
+            "post_t": self.ball_size / 2 + 1,
+            "field_rect": (self.margin - 2, self.margin - 2,
+                           self.width - 2 * self.margin + 4, self.height - 2 * self.margin + 4),
+        }
+        derived["left_goal_x_back"] = derived["left_goal_x_front"] - self.goal_w
+        derived["right_goal_x_back"] = derived["right_goal_x_front"] + self.goal_w
+        derived["left_wall_x"] = derived["left_goal_x_back"] - self.net_depth
+        derived["right_wall_x"] = derived["right_goal_x_back"] + self.net_depth
+        derived["goal_rect_left"] = (derived["left_goal_x_front"], derived["goal_y0"], self.goal_w, self.goal_h)
+        derived["goal_rect_right"] = (derived["right_goal_x_front"] - self.goal_w, derived["goal_y0"],
+                                      self.goal_w, self.goal_h)
+        for k, v in derived.items():
+            object.__setattr__(self, k, v)
+
+    def _validate(self):
+        def check(cond, msg):
+            if not cond:
+                raise ValueError(f"Perfil '{self.name}' inválido: {msg}")
+
+        for k in ("width", "height", "paddle_w", "paddle_h", "goal_w", "goal_h", "ball_size", "game_time", "fps"):
+            check(getattr(self, k) > 0, f"{k} deve ser positivo")
+        for k in ("paddle_speed", "ball_speed", "ball_speed_max"):
+            check(getattr(self, k) > 0, f"{k} deve ser positivo")
+        for k in ("margin", "goal_x_inset", "paddle_x_inset", "net_depth", "ball_speed_inc_on_hit"):
+            check(getattr(self, k) >= 0, f"{k} não pode ser negativo")
+        check(10 <= self.fps <= 240, "fps deve estar entre 10 e 240")
+        check(self.ball_speed <= self.ball_speed_max, "ball_speed maior que ball_speed_max")
+        check(0 <= self.ball_angle_max_deg < 90, "ball_angle_max_deg deve estar em [0, 90)")
+
+        inner_h = self.height - 2 * self.margin
+        check(self.paddle_h < inner_h, "paddle_h não cabe no rink")
+        check(self.goal_h < inner_h, "goal_h não cabe no rink")
+        check(self.ball_size < inner_h, "ball_size não cabe no rink")
+        # Esquerda para a direita: parede, goleira, paddle 1, meio, paddle 2, goleira, parede
+        left_wall = self.margin + self.goal_x_inset - self.goal_w - self.net_depth
+        check(left_wall >= 0, "goleira/rede saem da tela (aumente margin ou goal_x_inset)")
+        check(self.paddle_x_inset > self.goal_x_inset, "paddles precisam ficar à frente das goleiras")
+        check(self.margin + self.paddle_x_inset + self.paddle_w < self.width // 2,
+              "paddles se sobrepõem no meio do rink")
+
+    # Só os parâmetros; os derivados são recalculados por quem recebe
+    def to_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+
+    @classmethod
+    def from_dict(cls, d):
+        try:
+            kwargs = {f.name: f.type(d[f.name]) if f.type in (int, float, str) else d[f.name]
+                      for f in fields(cls) if f.init}
+        except KeyError as e:
+            raise ValueError(f"Perfil incompleto: falta {e}") from None
+        return cls(**kwargs)
+
+
+# Valores base: as constantes de config.py
+def _base_params():
+    return {
+        "width": WIDTH,
+        "height": HEIGHT,
+        "margin": MARGIN,
+        "paddle_w": PADDLE_W,
+        "paddle_h": PADDLE_H,
+        "goal_w": GOAL_W,
+        "goal_h": GOAL_H,
+        "ball_size": BALL_SIZE,
+        "paddle_speed": PADDLE_SPEED,
+        "ball_speed": BALL_SPEED,
+        "ball_speed_max": BALL_SPEED_MAX,
+        "ball_speed_inc_on_hit": BALL_SPEED_INC_ON_HIT,
+        "ball_angle_max_deg": BALL_ANGLE_MAX_DEG,
+        "goal_x_inset": GOAL_X_INSET,
+        "paddle_x_inset": PADDLE_X_INSET,
+        "net_depth": NET_DEPTH,
+        "game_time": GAME_TIME_SECONDS,
+        "fps": FPS,
+    }
+
+def load_profile(name):
+    if name not in PROFILES:
+        raise ValueError(f"Perfil desconhecido: '{name}' (disponíveis: {', '.join(PROFILES)})")
+    params = _base_params()
+    unknown = set(PROFILES[name]) - set(params)
+    if unknown:
+        raise ValueError(f"Perfil '{name}' inválido: parâmetros desconhecidos {sorted(unknown)}")
+    params.update(PROFILES[name])
+    return Geometry.from_dict({"name": name, **params})
+
+def load_profiles():
+    return {name: load_profile(name) for name in PROFILES}
@@ -6,6 +6,10 @@ import select
 import time
 import argparse
 from config import *
+from latencia import LatencyEstimator, make_pong
+from geometria import Geometry
+from fisica import keys_to_bits
+from rollback import RollbackSession
 
 # Envia informações para o servidor
 def send_json(sock, obj):
@@ -37,6 +41,26 @@ def pump_recv(sock, buffer):
         pass
     return msgs, buffer
 
+def connect_server(host, port, timeout):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    # Reduzir latência (mandar tudo na hora, sem esperar juntar bytes para enviar tudo junto)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except Exception:
+        print("Erro ao tentar reduzir latência.")
+        pass
+
+    try:
+        sock.settimeout(timeout)
+        sock.connect((host, port))
+        sock.settimeout(None)
+        sock.setblocking(False)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
 def notify_exit(sock):
     try:
         # Dá um tempinho pra garantir que o JSON saia do buffer
@@ -56,6 +80,35 @@ def notify_exit(sock):
         except Exception as e:
             print(f"[Client] Erro ao fechar a conexão: {e}")
 
+# Painel de depuração de rede (F3)
+def draw_debug(screen, font, geo, latency, server_tick, snap_age, snap_hz, snap_detail, handshake,
+               session, desync_frame):
+    def fmt(v):
+        return "--" if v is None else f"{v * 1000:.1f}"
+    lines = [
+        f"RTT: {fmt(latency.rtt)} ms  (jitter {fmt(latency.rtt_var if latency.samples else None)} ms)",
+        f"RTT min/último: {fmt(latency.rtt_min)} / {fmt(latency.rtt_last)} ms",
+        f"Offset relógio: {fmt(latency.offset)} ms",
+        f"Tick servidor: {server_tick if server_tick is not None else '--'}",
+        f"Idade snapshot: {fmt(snap_age)} ms",
+        f"Snapshots: {snap_hz:.0f} Hz  ({'reduzido' if snap_detail else 'completo'})",
+        f"Handshake: {fmt(handshake)} ms",
+    ]
+    if session is not None:
+        m = session.metrics()
+        lines[3:6] = [
+            f"Frame: {m['frame']}  (à frente do remoto: {m['remote_lag']})",
+            f"Rollbacks: {m['rollbacks']}  (máx {m['resim_frames_max']} frames)",
+            f"Resimulação: {m['resim_ms_last']:.2f} ms, máx {m['resim_ms_max']:.2f} ms ({m['budget_pct']}% do frame)",
+        ]
+        if desync_frame is not None:
+            lines.append(f"DESSINCRONIZADO no frame {desync_frame}")
+    y = geo.height - geo.margin - 4 - len(lines) * (font.get_linesize())
+    for line in lines:
+        txt = font.render(line, True, COLOR_DEBUG)
+        screen.blit(txt, (geo.margin + 6, y))
+        y += font.get_linesize()
+
 
 def main():
     parser = argparse.ArgumentParser(description="Hockey I - Cliente")
@@ -63,6 +116,10 @@ def main():
                         help="IP/host do servidor (ex.: 192.168.0.10)")
     parser.add_argument("--port", type=int, default=PORT,
                         help=f"Porta TCP do servidor (default: {PORT})")
+    parser.add_argument("--profile", default=None,
+                        help="Perfil de regras desejado (default: o do servidor)")
+    parser.add_argument("--mode", default=None, choices=(MODE_SERVER, MODE_ROLLBACK),
+                        help="Modo de rede desejado (default: o do servidor)")
     args = parser.parse_args()
 
     server_host = args.server
@@ -70,27 +127,17 @@ def main():
 
     pygame.init()
     pygame.display.set_caption("Hockey I")
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
     clock = pygame.time.Clock()
     font = pygame.font.SysFont("Arial", 16, bold=True)
     bigfont = pygame.font.SysFont("Arial", 36, bold=True)
+    smallfont = pygame.font.SysFont("Arial", 13)
 
     # Conecta
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-   
-    # Reduzir latência (mandar tudo na hora, sem esperar juntar bytes para enviar tudo junto)
-    try:
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    except Exception:
-        print("Erro ao tentar reduzir latência.")
-        pass
-
     print(f"[Client] Conectando em {server_host}:{server_port} ...")
+    t_connect = time.monotonic()
     try:
-        sock.settimeout(2.0)
-        sock.connect((server_host, server_port))
-        sock.settimeout(None)
-        sock.setblocking(False)
+        sock = connect_server(server_host, server_port, 2.0)
+        send_json(sock, {"type": "join", "profile": args.profile, "mode": args.mode})
     except (ConnectionRefusedError, TimeoutError, OSError, socket.timeout) as e:
         print(f"[Client] Falha ao conectar ao servidor: {e}")
         pygame.quit()
@@ -98,39 +145,99 @@ def main():
 
     # Estado local
     my_player = None
-    paddles = {"p1": {"y": HEIGHT//2 - PADDLE_H//2}, "p2": {"y": HEIGHT//2 - PADDLE_H//2}}
-    ball = {"x": WIDTH//2, "y": HEIGHT//2}
+    geo = None  # regras/geometria da partida, vindas do servidor no hello
+    mode = MODE_SERVER
+    session = None  # RollbackSession (só no modo rollback)
+    desync_frame = None
+    match_started = False
+    sim_accum = 0.0  # tempo real acumulado ainda não simulado (passo fixo)
+    sim_last = time.monotonic()
     score = {"p1": 0, "p2": 0}
-    time_left = GAME_TIME_SECONDS
     game_over = False
 
+    # Métricas de rede
+    latency = LatencyEstimator()
+    server_tick = None
+    snap_age = None
+    snap_detail = 0
+    snap_count = 0
+    snap_hz = 0.0
+    snap_window_start = time.monotonic()
+    show_debug = False
+    handshake = None  # connect -> hello (s)
+
+    # Sessão (para reconectar sem perder a partida)
+    token = None
+    grace = RECONNECT_GRACE_SECONDS
+    last_msg_at = time.monotonic()
+    reconnect_deadline = None  # != None enquanto tenta reconectar
+    next_attempt = 0.0
+    awaiting_resume = False
+    opponent_lost_until = None
+    paused = False
+
     # Input (mantém estado de tecla)
     keys_state = {"up": False, "down": False}
 
     # Recebe hello inicial do servidor
     buffer = bytearray()
     hello_ok = False
+    pending = []  # mensagens que chegaram junto com o hello (ex.: match_start)
     t0 = time.monotonic()
     while not hello_ok:
         r, _, _ = select.select([sock], [], [], 0.1)
         for _ in r:
             msgs, buffer = pump_recv(sock, buffer)
-            for msg in msgs:
+            for i, msg in enumerate(msgs):
                 if msg.get("type") == "hello":
                     my_player = msg["player"]
+                    token = msg.get("token")
+                    grace = msg.get("grace", grace)
+                    handshake = time.monotonic() - t_connect
+                    mode = msg.get("mode", MODE_SERVER)
+                    try:
+                        geo = Geometry.from_dict(msg["rules"])
+                    except (KeyError, TypeError, ValueError) as e:
+                        print(f"[Client] Regras inválidas recebidas do servidor: {e}")
+                        pygame.quit()
+                        return
                     hello_ok = True
+                    pending = msgs[i + 1:]
+                    break
+                elif msg.get("type") == "busy":
+                    print(f"[Client] Servidor recusou a conexão: {msg.get('reason', 'ocupado')}")
+                    pygame.quit()
+                    return
         if time.monotonic() - t0 > 5.0:
             print("[Client] Timeout aguardando hello do servidor.")
             pygame.quit()
             return
 
+    # Janela e estado inicial no tamanho do rink desta partida
+    screen = pygame.display.set_mode((geo.width, geo.height))
+    paddles = {"p1": {"y": geo.paddle_y_start}, "p2": {"y": geo.paddle_y_start}}
+    ball = {"x": geo.center_x, "y": geo.center_y}
+    time_left = geo.game_time
+
+    # Medidas de desenho dos paddles (fixas por partida)
+    h1 = geo.paddle_h // 3
+    h2 = geo.paddle_h // 3
+    h3 = geo.paddle_h - h1 - h2
+
+    # Raios seguros (não podem passar de metade de w/h do retângulo)
+    r_full = min(geo.paddle_w // 2, geo.paddle_h // 2)
+    r_top = min(geo.paddle_w // 2, h1 // 2)
+    r_bot = min(geo.paddle_w // 2, h3 // 2)
+    ball_r = geo.ball_size // 2
+
     # Loop principal
     running = True
     while running:
         # -------- Eventos --------
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                notify_exit(sock)
+                if sock is not None:
+                    notify_exit(sock)
                 running = False
 
             elif event.type == pygame.KEYDOWN:
@@ -139,8 +246,11 @@ def main():
                 elif event.key in (pygame.K_DOWN, pygame.K_s):
                     keys_state["down"] = True
                 elif event.key == pygame.K_ESCAPE:
-                    notify_exit(sock)
+                    if sock is not None:
+                        notify_exit(sock)
                     running = False
+                elif event.key == pygame.K_F3:
+                    show_debug = not show_debug
 
             elif event.type == pygame.KEYUP:
                 if event.key in (pygame.K_UP, pygame.K_w):
@@ -148,99 +258,218 @@ def main():
                 elif event.key in (pygame.K_DOWN, pygame.K_s):
                     keys_state["down"] = False
 
+        # -------- Reconexão --------
+        now = time.monotonic()
+        if running and sock is None:
+            if now > reconnect_deadline:
+                print("[Client] Não foi possível reconectar a tempo. Encerrando.")
+                running = False
+            elif now >= next_attempt:
+                next_attempt = now + RECONNECT_RETRY_INTERVAL
+                t_connect = now
+                try:
+                    sock = connect_server(server_host, server_port, RECONNECT_RETRY_INTERVAL)
+                    # Sem novo handshake: apresenta o token e espera o keyframe
+                    send_json(sock, {"type": "resume", "token": token})
+                    buffer = bytearray()
+                    awaiting_resume = True
+                    last_msg_at = time.monotonic()
+                except (OSError, socket.timeout):
+                    sock = None
+
         # Envia input atual (uma vez por frame é suficiente)
-        if running:
+        if running and sock is not None and not awaiting_resume:
             try:
-                send_json(sock, {"type": "input", "keys": keys_state})
+                if mode == MODE_SERVER:
+                    send_json(sock, {"type": "input", "keys": keys_state})
+                now = time.monotonic()
+                if latency.ping_due(now):
+                    send_json(sock, latency.make_ping(now))
             except Exception as e:
                 print(f"[Client] Falha ao enviar input: {e}")
-                running = False
+                sock = None
 
         # Recebe estados (podem chegar múltiplos por frame)
         try:
+            if sock is None:
+                raise ConnectionError("sem conexão")
             msgs, buffer = pump_recv(sock, buffer)
+            if pending:
+                msgs, pending = pending + msgs, []
+            if msgs:
+                last_msg_at = time.monotonic()
+            t_recv = time.monotonic()
             for msg in msgs:
-                if msg.get("type") == "state":
+                if msg.get("type") == "ping":
+                    send_json(sock, make_pong(msg, t_recv))
+                elif msg.get("type") == "pong":
+                    latency.on_pong(msg, t_recv)
+                elif msg.get("type") == "match_start":
+                    match_started = True
+                    if mode == MODE_ROLLBACK:
+                        session = RollbackSession(geo, msg["seed"], my_player - 1,
+                                                  msg.get("input_delay", ROLLBACK_INPUT_DELAY))
+                        sim_accum = 0.0
+                        sim_last = t_recv
+                        for frame, bits in session.start():
+                            send_json(sock, {"type": "input_frame", "frame": frame, "keys": bits})
+                elif msg.get("type") == "input_frame" and session is not None:
+                    session.add_remote(msg["frame"], msg["keys"])
+                elif msg.get("type") == "input_log":
+                    # Retomada no modo rollback: refaz a partida a partir do log do servidor
+                    # (inclusive se a queda foi antes do match_start e ainda não há sessão)
+                    match_started = True
+                    delay = msg.get("input_delay", ROLLBACK_INPUT_DELAY if session is None else session.delay)
+                    session, to_send = RollbackSession.from_log(geo, msg["seed"], my_player - 1,
+                                                                msg["inputs"], delay)
+                    sim_accum = 0.0
+                    sim_last = t_recv
+                    for frame, bits in to_send:
+                        send_json(sock, {"type": "input_frame", "frame": frame, "keys": bits})
+                elif msg.get("type") == "desync":
+                    desync_frame = msg.get("frame")
+                    print(f"[Client] Simulação dessincronizada no frame {desync_frame}")
+                elif msg.get("type") == "state":
+                    match_started = True
+                    server_tick = msg.get("tick")
+                    snap_detail = msg.get("detail", 0)
+                    snap_count += 1
+                    if "server_time" in msg and latency.offset is not None:
+                        snap_age = t_recv - latency.remote_to_local(msg["server_time"])
                     ball = msg["ball"]
                     paddles["p1"] = msg["p1"]
                     paddles["p2"] = msg["p2"]
-                    score = msg["score"]
-                    time_left = msg["time"]
-                    game_over = msg.get("game_over", False)
+                    # Snapshots reduzidos só trazem placar/tempo quando mudam
+                    score = msg.get("score", score)
+                    time_left = msg.get("time", time_left)
+                    game_over = msg.get("game_over", game_over)
+                    paused = msg.get("paused", paused)
+                elif msg.get("type") == "resumed":
+                    print("[Client] Sessão retomada.")
+                    match_started = True
+                    awaiting_resume = False
+                    reconnect_deadline = None
+                    handshake = t_recv - t_connect
+                    latency = LatencyEstimator()  # caminho novo, medições novas
+                elif msg.get("type") == "busy":
+                    print("[Client] Servidor recusou a reconexão. Encerrando.")
+                    running = False
+                elif msg.get("type") == "opponent_lost":
+                    opponent_lost_until = t_recv + msg.get("grace", grace)
+                elif msg.get("type") == "opponent_back":
+                    opponent_lost_until = None
                 elif msg.get("type") == "opponent_left":
                     print("[Client] Oponente saiu. Encerrando.")
                     running = False
+            # Silêncio prolongado no meio da partida também conta como queda
+            if match_started and time.monotonic() - last_msg_at > CONNECTION_TIMEOUT:
+                raise ConnectionError("servidor não responde")
+
+            # Modo rollback: corrige previsões erradas e avança a simulação local
+            if session is not None and not awaiting_resume:
+                session.reconcile()
+                # Passo fixo pelo relógio real; enquanto espera o oponente o relógio não acumula,
+                # e depois recupera no máximo 2 frames por quadro
+                now = time.monotonic()
+                if session.can_advance():
+                    sim_accum = min(sim_accum + (now - sim_last), 4 * geo.dt)
+                sim_last = now
+                steps = 0
+                while sim_accum >= geo.dt and steps < 2 and session.can_advance():
+                    sent = session.advance(keys_to_bits(keys_state))
+                    if sent is not None:
+                        send_json(sock, {"type": "input_frame", "frame": sent[0], "keys": sent[1]})
+                    sim_accum -= geo.dt
+                    steps += 1
+                for frame, value in session.pop_checksums():
+                    send_json(sock, {"type": "checksum", "frame": frame, "value": value})
         except Exception as e:
-            print(f"[Client] Conexão encerrada: {e}")
-            running = False
+            if sock is not None:
+                print(f"[Client] Conexão encerrada: {e}")
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+                sock = None
+            if running and not game_over and token is not None:
+                # Queda de rede: tenta retomar a mesma partida dentro do prazo
+                if reconnect_deadline is None:
+                    print(f"[Client] Tentando reconectar por até {grace:.0f}s ...")
+                    reconnect_deadline = time.monotonic() + grace
+                    next_attempt = 0.0
+                awaiting_resume = False
+            else:
+                running = False
+
+        now = time.monotonic()
+        if now - snap_window_start >= 1.0:
+            snap_hz = snap_count / (now - snap_window_start)
+            snap_count = 0
+            snap_window_start = now
+
+        if session is not None:
+            st = session.state
+            ball = {"x": st.ball_x, "y": st.ball_y}
+            paddles["p1"] = {"y": st.p1_y}
+            paddles["p2"] = {"y": st.p2_y}
+            score = {"p1": st.score1, "p2": st.score2}
+            time_left = session.time_left()
+            game_over = session.game_over
 
         # Render
         screen.fill(COLOR_BG)
 
         # Linhas de campo
-        pygame.draw.rect(screen, COLOR_FIELD_BORDER, (MARGIN-2, MARGIN-2, WIDTH-2*MARGIN+4, HEIGHT-2*MARGIN+4), 2)
-        pygame.draw.line(screen, COLOR_FIELD_MIDLINE, (WIDTH//2, MARGIN), (WIDTH//2, HEIGHT-MARGIN), 1)
-
-        # Paddles
-        h1 = PADDLE_H // 3
-        h2 = PADDLE_H // 3
-        h3 = PADDLE_H - h1 - h2
-
-        # Raios seguros (não podem passar de metade de w/h do retângulo)
-        r_full = min(PADDLE_W // 2, PADDLE_H // 2)
-        r_top = min(PADDLE_W // 2, h1 // 2)
-        r_bot = min(PADDLE_W // 2, h3 // 2)
+        pygame.draw.rect(screen, COLOR_FIELD_BORDER, geo.field_rect, 2)
+        pygame.draw.line(screen, COLOR_FIELD_MIDLINE, (geo.center_x, geo.margin), (geo.center_x, geo.height - geo.margin), 1)
 
         # P1 (esquerda) – canto superior e inferior arredondados no paddle inteiro
-        p1x = MARGIN + 80
+        p1x = geo.p1_x
         p1y = int(paddles["p1"]["y"])
         pygame.draw.rect(
             screen, COLOR_PADDLE,
-            (p1x, p1y, PADDLE_W, PADDLE_H),
+            (p1x, p1y, geo.paddle_w, geo.paddle_h),
             border_radius=r_full
         )
 
         # P2 (direita) – três faixas com topo e base arredondados
-        p2x = WIDTH - MARGIN - PADDLE_W - 80
+        p2x = geo.p2_x
         p2y = int(paddles["p2"]["y"])
 
         # Topo (arredonda só os cantos de cima)
         pygame.draw.rect(
             screen, COLOR_PADDLE2_1,
-            (p2x, p2y, PADDLE_W, h1),
+            (p2x, p2y, geo.paddle_w, h1),
             border_top_left_radius=r_top, border_top_right_radius=r_top
         )
 
         # Meio (sem arredondamento)
         pygame.draw.rect(
             screen, COLOR_PADDLE2_2,
-            (p2x, p2y + h1, PADDLE_W, h2)
+            (p2x, p2y + h1, geo.paddle_w, h2)
         )
 
         # Base (arredonda só os cantos de baixo)
         pygame.draw.rect(
             screen, COLOR_PADDLE2_3,
-            (p2x, p2y + h1 + h2, PADDLE_W, h3),
+            (p2x, p2y + h1 + h2, geo.paddle_w, h3),
             border_bottom_left_radius=r_bot, border_bottom_right_radius=r_bot
         )
 
         # Goleiras
-        g1x = MARGIN + 40
-        g2x = WIDTH - MARGIN - GOAL_W - 40
-        pygame.draw.rect(screen, COLOR_GOAL, (g1x, HEIGHT // 2 - GOAL_H // 2, GOAL_W, GOAL_H))
-        pygame.draw.rect(screen, COLOR_GOAL, (g2x, HEIGHT // 2 - GOAL_H // 2, GOAL_W, GOAL_H))
+        pygame.draw.rect(screen, COLOR_GOAL, geo.goal_rect_left)
+        pygame.draw.rect(screen, COLOR_GOAL, geo.goal_rect_right)
 
         # Bola
         cx = int(ball["x"])
         cy = int(ball["y"])
-        r = BALL_SIZE // 2
-        pygame.draw.circle(screen, COLOR_BALL, (cx, cy), r)
+        pygame.draw.circle(screen, COLOR_BALL, (cx, cy), ball_r)
 
         # Placar e tempo
         score_text = font.render(f"{score['p1']}  :  {score['p2']}", True, COLOR_SCORE)
         time_text  = font.render(f"Tempo: {time_left:03d}s", True, COLOR_TIME)
-        screen.blit(score_text, (WIDTH//2 - score_text.get_width()//2, 8))
-        screen.blit(time_text, (WIDTH - time_text.get_width() - 12, 8))
+        screen.blit(score_text, (geo.center_x - score_text.get_width()//2, 8))
+        screen.blit(time_text, (geo.width - time_text.get_width() - 12, 8))
 
         # Etiqueta do jogador local
         who = "Você é: P1 (Inter)" if my_player == 1 else "Você é: P2 (Grêmio)"
@@ -249,20 +478,35 @@ def main():
 
         if game_over:
             over = bigfont.render("FIM DE JOGO", True, COLOR_GAMEOVER)
-            screen.blit(over, (WIDTH//2 - over.get_width()//2, HEIGHT//2 - over.get_height()//2 - 20))
+            screen.blit(over, (geo.center_x - over.get_width()//2, geo.center_y - over.get_height()//2 - 20))
             winner = "Empate!"
             if score["p1"] > score["p2"]:
                 winner = "Vitória do Inter"
             elif score["p2"] > score["p1"]:
                 winner = "Vitória do Grêmio"
             wtxt = font.render(winner, True, COLOR_WINNER)
-            screen.blit(wtxt, (WIDTH//2 - wtxt.get_width()//2, HEIGHT//2 + 20))
+            screen.blit(wtxt, (geo.center_x - wtxt.get_width()//2, geo.center_y + 20))
+
+        if reconnect_deadline is not None:
+            secs = max(0, int(reconnect_deadline - time.monotonic()))
+            rtxt = font.render(f"Reconectando... ({secs}s)", True, COLOR_GAMEOVER)
+            screen.blit(rtxt, (geo.center_x - rtxt.get_width()//2, geo.center_y - 60))
+        elif opponent_lost_until is not None and not game_over:
+            secs = max(0, int(opponent_lost_until - time.monotonic()))
+            status = "partida pausada" if paused else "jogo segue"
+            otxt = font.render(f"Oponente caiu, aguardando ({secs}s) - {status}", True, COLOR_GAMEOVER)
+            screen.blit(otxt, (geo.center_x - otxt.get_width()//2, geo.center_y - 60))
+
+        if show_debug:
+            draw_debug(screen, smallfont, geo, latency, server_tick, snap_age, snap_hz, snap_detail, handshake,
+                       session, desync_frame)
 
         pygame.display.flip()
-        clock.tick(FPS)
+        clock.tick(geo.fps)
 
     try:
-        sock.close()
+        if sock is not None:
+            sock.close()
     except Exception as e:
         print(f"[Client] Erro ao fechar a conexão: {e}")
     pygame.quit()
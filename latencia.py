@@ -0,0 +1,81 @@
+import time
+from config import *
+
+# Estimativa de RTT e diferença de relógio (ping/pong), usada pelo servidor e pelo cliente.
+#
+# Quem inicia manda  {"type": "ping", "seq": n, "t0": envio}
+# Quem responde manda {"type": "pong", "seq": n, "t0": t0, "t1": recebido, "t2": respondido}
+# Ao receber o pong (t3), estilo NTP:
+#   rtt    = (t3 - t0) - (t2 - t1)
+#   offset = ((t1 - t0) + (t2 - t3)) / 2   -> relógio remoto - relógio local
+# Todos os tempos são time.monotonic() do lado que os anotou.
+
+def make_pong(ping, t1):
+    return {
+        "type": "pong",
+        "seq": ping.get("seq"),
+        "t0": ping.get("t0"),
+        "t1": t1,
+        "t2": time.monotonic(),
+    }
+
+
+class LatencyEstimator:
+    def __init__(self):
+        self.seq = 0
+        self.last_ping_at = None
+        self.rtt = None       # RTT suavizado (s)
+        self.rtt_var = 0.0    # variação média do RTT (s), ~jitter
+        self.rtt_min = None
+        self.rtt_last = None
+        self.offset = None    # relógio remoto - relógio local (s)
+        self.samples = 0
+
+    def ping_due(self, now):
+        return self.last_ping_at is None or now - self.last_ping_at >= PING_INTERVAL
+
+    def make_ping(self, now):
+        self.seq += 1
+        self.last_ping_at = now
+        return {"type": "ping", "seq": self.seq, "t0": now}
+
+    def on_pong(self, msg, t3):
+        try:
+            t0 = float(msg["t0"])
+            t1 = float(msg["t1"])
+            t2 = float(msg["t2"])
+        except (KeyError, TypeError, ValueError):
+            return
+        rtt = max(0.0, (t3 - t0) - (t2 - t1))
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+
+        self.rtt_last = rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        if self.rtt is None:
+            # Primeira amostra: inicializa como no TCP (RFC 6298)
+            self.rtt = rtt
+            self.rtt_var = rtt / 2
+            self.offset = offset
+        else:
+            self.rtt_var += RTT_BETA * (abs(self.rtt - rtt) - self.rtt_var)
+            self.rtt += RTT_ALPHA * (rtt - self.rtt)
+            # Amostras com RTT muito acima do normal têm offset pouco confiável
+            if rtt <= self.rtt + 2 * self.rtt_var:
+                self.offset += OFFSET_ALPHA * (offset - self.offset)
+        self.samples += 1
+
+    def remote_to_local(self, t_remote):
+        # Converte um instante do relógio remoto para o relógio local
+        return t_remote - (self.offset or 0.0)
+
+    def metrics(self):
+        def ms(v):
+            return None if v is None else round(v * 1000, 2)
+        return {
+            "rtt_ms": ms(self.rtt),
+            "rtt_var_ms": ms(self.rtt_var if self.samples else None),
+            "rtt_min_ms": ms(self.rtt_min),
+            "rtt_last_ms": ms(self.rtt_last),
+            "offset_ms": ms(self.offset),
+            "samples": self.samples,
+        }
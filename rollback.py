@@ -0,0 +1,163 @@
+import time
+from config import *
+from fisica import GameState, KEYS_FROM_BITS, step_physics, state_checksum
+
+# Sessão de rollback do cliente (modo MODE_ROLLBACK).
+#
+# Os dois clientes rodam a mesma simulação em passo fixo (geo.dt), a partir da mesma
+# semente, e trocam só inputs (via servidor). O input local vale `delay` frames depois
+# de lido; o remoto, enquanto não chega, é previsto repetindo o último conhecido.
+# Quando chega um input remoto diferente do previsto, o estado volta ao frame em
+# questão (guardado em `history`) e os frames seguintes são simulados de novo.
+
+class RollbackSession:
+    def __init__(self, geo, seed, local_slot, delay=ROLLBACK_INPUT_DELAY):
+        self.geo = geo
+        self.local = local_slot
+        self.remote = 1 - local_slot
+        self.delay = delay
+        self.state = GameState(geo, seed)
+        self.total_frames = geo.game_time * geo.fps
+
+        self.frame = 0           # próximo frame a simular
+        self.inputs = [[], []]   # inputs confirmados por vaga, indexados por frame
+        self.predicted = {}      # frame -> input remoto usado na previsão
+        self.history = {}        # frame -> estado salvo antes de simular o frame
+        self.rollback_from = None
+        self.next_checksum = ROLLBACK_CHECKSUM_INTERVAL
+
+        # Métricas
+        self.rollbacks = 0
+        self.resim_frames_max = 0
+        self.resim_ms_last = 0.0
+        self.resim_ms_max = 0.0
+
+    # Reconstrói a sessão a partir do log de inputs do servidor (retomada após queda);
+    # devolve a sessão e os inputs locais que ainda precisam ser enviados
+    @classmethod
+    def from_log(cls, geo, seed, local_slot, logs, delay=ROLLBACK_INPUT_DELAY):
+        session = cls(geo, seed, local_slot, delay)
+        session.inputs = [list(logs[0]), list(logs[1])]
+        to_send = []
+        while len(session.inputs[local_slot]) < delay:
+            to_send.append((session.push_local(0), 0))
+        target = min(len(session.inputs[local_slot]) - delay, session.total_frames)
+        while session.frame < target:
+            session._simulate()
+        confirmed = session.confirmed_frames()
+        session.next_checksum = (confirmed // ROLLBACK_CHECKSUM_INTERVAL + 1) * ROLLBACK_CHECKSUM_INTERVAL
+        session._prune(confirmed)
+        return session, to_send
+
+    # -------- Inputs --------
+    def start(self):
+        # Os primeiros `delay` frames não têm tecla lida: input neutro
+        return [(self.push_local(0), 0) for _ in range(self.delay)]
+
+    def push_local(self, bits):
+        frame = len(self.inputs[self.local])
+        self.inputs[self.local].append(bits)
+        return frame
+
+    def add_remote(self, frame, bits):
+        remote = self.inputs[self.remote]
+        if frame != len(remote):
+            return  # duplicado ou fora de ordem (o servidor já garante a sequência)
+        remote.append(bits)
+        guess = self.predicted.pop(frame, None)
+        if guess is not None and guess != bits:
+            if self.rollback_from is None or frame < self.rollback_from:
+                self.rollback_from = frame
+
+    def _input(self, slot, frame):
+        inp = self.inputs[slot]
+        if frame < len(inp):
+            return inp[frame]
+        # Previsão: repete o último input conhecido
+        bits = inp[-1] if inp else 0
+        if slot == self.remote:
+            self.predicted[frame] = bits
+        return bits
+
+    # -------- Simulação --------
+    @property
+    def game_over(self):
+        return self.frame >= self.total_frames
+
+    def time_left(self):
+        return max(0, int((self.total_frames - self.frame) / self.geo.fps))
+
+    def confirmed_frames(self):
+        return min(len(self.inputs[self.remote]), self.frame)
+
+    def remote_lag(self):
+        return self.frame - len(self.inputs[self.remote])
+
+    def can_advance(self):
+        return not self.game_over and self.remote_lag() < ROLLBACK_MAX_FRAMES
+
+    def _simulate(self):
+        f = self.frame
+        self.history[f] = self.state.save()
+        keys = [KEYS_FROM_BITS[self._input(0, f)], KEYS_FROM_BITS[self._input(1, f)]]
+        step_physics(self.state, keys, self.geo.dt, self.geo)
+        self.state.tick = f + 1
+        self.frame = f + 1
+
+    # Registra a tecla lida agora e simula um frame; devolve (frame, bits) a enviar ou None
+    def advance(self, local_bits):
+        sent = None
+        if len(self.inputs[self.local]) < self.total_frames:
+            sent = (self.push_local(local_bits), local_bits)
+        self._simulate()
+        return sent
+
+    # Volta ao primeiro frame previsto errado e simula de novo até o frame atual
+    def reconcile(self):
+        if self.rollback_from is None:
+            return
+        f0 = self.rollback_from
+        self.rollback_from = None
+        target = self.frame
+
+        t0 = time.perf_counter()
+        self.state.load(self.history[f0])
+        self.frame = f0
+        for f in range(f0, target):
+            self.predicted.pop(f, None)
+        while self.frame < target:
+            self._simulate()
+        self.resim_ms_last = (time.perf_counter() - t0) * 1000
+
+        self.rollbacks += 1
+        self.resim_frames_max = max(self.resim_frames_max, target - f0)
+        self.resim_ms_max = max(self.resim_ms_max, self.resim_ms_last)
+
+    # Checksums de frames já confirmados pelos dois lados: [(frame, crc)]
+    def pop_checksums(self):
+        out = []
+        confirmed = self.confirmed_frames()
+        while self.next_checksum <= confirmed:
+            c = self.next_checksum
+            saved = self.state.save() if c == self.frame else self.history[c]
+            out.append((c, state_checksum(saved)))
+            self.next_checksum += ROLLBACK_CHECKSUM_INTERVAL
+        self._prune(confirmed)
+        return out
+
+    # Frames anteriores ao último confirmado nunca mais serão alvo de rollback nem de checksum
+    def _prune(self, confirmed):
+        keep_from = min(confirmed, self.next_checksum)
+        for f in [f for f in self.history if f < keep_from]:
+            del self.history[f]
+
+    def metrics(self):
+        return {
+            "frame": self.frame,
+            "remote_lag": self.remote_lag(),
+            "rollbacks": self.rollbacks,
+            "resim_frames_max": self.resim_frames_max,
+            "resim_ms_last": round(self.resim_ms_last, 3),
+            "resim_ms_max": round(self.resim_ms_max, 3),
+            "budget_pct": round(self.resim_ms_max / (self.geo.dt * 1000) * 100, 1),
+        }
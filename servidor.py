@@ -2,16 +2,15 @@ import socket
 import struct
 import json
 import time
-import math
 import select
 import argparse
+import secrets
+from collections import deque
 from config import *
-
-# Manda as informações do estado do jogo
-def send_json(sock, obj):
-    data = json.dumps(obj, separators=(",", ":")).encode("utf-8")
-    header = struct.pack("!I", len(data))
-    sock.sendall(header + data)
+from latencia import LatencyEstimator, make_pong
+from fluxo import ClientLink
+from geometria import load_profiles
+from fisica import GameState, step_physics
 
 # Consome um bytearray e rende mensagens JSON completas
 def recv_frames(buffer):
@@ -27,57 +26,377 @@ def recv_frames(buffer):
         out.append(json.loads(payload.decode("utf-8")))
     return out
 
-# --------- Estado ---------
-class GameState:
-    def __init__(self):
-        self.reset_full()
-
-    def reset_full(self):
-        self.p1_y = HEIGHT // 2 - PADDLE_H // 2
-        self.p2_y = HEIGHT // 2 - PADDLE_H // 2
-        self.score1 = 0
-        self.score2 = 0
-        self.ball_x = WIDTH // 2
-        self.ball_y = HEIGHT // 2
-        self.ball_vx = BALL_SPEED if time.time_ns() % 2 else -BALL_SPEED
-        self.ball_vy = 0.0
-        self.game_started_at = None
-        self.game_over = False
-
-    def reset_ball(self, to_left: bool):
-        self.ball_x = WIDTH // 2
-        self.ball_y = HEIGHT // 2
-        self.ball_vx = -BALL_SPEED if to_left else BALL_SPEED
-        self.ball_vy = 0.0
-
-    def snapshot(self, remaining):
-        return {
-            "type": "state",
-            "ball": {"x": self.ball_x, "y": self.ball_y},
-            "p1": {"y": self.p1_y},
-            "p2": {"y": self.p2_y},
-            "score": {"p1": self.score1, "p2": self.score2},
-            "time": max(0, int(remaining)),
-            "game_over": self.game_over,
-        }
-
 # --------- Utilidades ---------
-def clamp(v, lo, hi):
-    return max(lo, min(hi, v))
+def setup_conn(conn):
+    # reduzir latência
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except Exception:
+        pass
+    conn.setblocking(False)
+
+# --------- Conexões e partidas ---------
+class Connection:
+    def __init__(self, sock, addr, now):
+        self.sock = sock
+        self.addr = addr
+        self.buffer = bytearray()
+        self.latency = LatencyEstimator()
+        self.link = ClientLink(sock, now)
+        self.accepted_at = now
+        self.last_heard = now
+        self.match = None  # None enquanto não terminou o handshake
+        self.slot = None
+
+    def send(self, obj):
+        self.link.queue(obj)
+        self.link.flush()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class Match:
+    # Modo servidor: o servidor simula e manda snapshots (ver RollbackMatch para o outro modo)
+    mode = MODE_SERVER
+
+    def __init__(self, match_id, now, geo):
+        self.id = match_id
+        self.geo = geo
+        # Estado por vaga (índice 0 = P1, 1 = P2); a conexão de uma vaga muda quando o jogador reconecta
+        self.conns = [None, None]
+        self.tokens = [secrets.token_hex(16), secrets.token_hex(16)]
+        self.lost_at = [None, None]  # instante em que a vaga caiu (None = conectada)
+        self.inputs = [{"up": False, "down": False}, {"up": False, "down": False}]
+        self.seed = secrets.randbits(32)
+        self.state = GameState(geo, self.seed)
+        self.started = False
+        self.remaining = geo.game_time
+        self.last_time = now
+        self.next_tick_at = None
+        self.close_at = None  # partida encerrada: fecha as conexões a partir deste instante
+
+    def is_open(self, geo, mode):
+        return (not self.started and self.close_at is None and self.conns[1] is None
+                and self.geo is geo and self.mode == mode)
+
+    def attach(self, slot, conn, now):
+        self.conns[slot] = conn
+        self.lost_at[slot] = None
+        self.inputs[slot] = {"up": False, "down": False}
+        conn.match = self
+        conn.slot = slot
+        # Clientes saudáveis recebem um snapshot por tick desta partida
+        conn.link.set_tick_rate(self.geo.fps)
+
+    def start(self, now):
+        self.started = True
+        self.state.game_started_at = now
+        self.last_time = now
+        self.next_tick_at = now
+        for c in self.conns:
+            try:
+                c.send(self.start_message())
+            except Exception:
+                pass
+        print(f"[Server] Partida {self.id}: dois jogadores conectados. Iniciando jogo!")
+
+    def start_message(self):
+        return {"type": "match_start"}
+
+    def finish(self, now, delay):
+        if self.close_at is None:
+            self.close_at = now + delay
+
+    def notify_other(self, slot, obj):
+        oc = self.conns[1 - slot]
+        if oc is None:
+            return
+        try:
+            oc.send(obj)
+        except Exception as e:
+            print(f"[Servidor] Erro ao tentar avisar o outro jogador: {e}")
+
+    # Queda de conexão: segura a vaga por RECONNECT_GRACE_SECONDS em vez de encerrar a partida
+    def player_lost(self, slot, reason, now):
+        print(f"[Server] Partida {self.id}: player {slot + 1} caiu ({reason}); "
+              f"aguardando reconexão por {RECONNECT_GRACE_SECONDS:.0f}s")
+        self.conns[slot] = None
+        self.lost_at[slot] = now
+        self.inputs[slot] = {"up": False, "down": False}
+        self.notify_other(slot, {"type": "opponent_lost", "grace": RECONNECT_GRACE_SECONDS})
+
+    def resume(self, slot, conn, now):
+        self.attach(slot, conn, now)
+        # Retoma direto com um keyframe completo, sem novo handshake
+        conn.link.queue({
+            "type": "resumed",
+            "player": slot + 1,
+            "width": self.geo.width,
+            "height": self.geo.height,
+            "mode": self.mode,
+        })
+        conn.link.queue(self.keyframe())
+        conn.link.flush()
+        self.notify_other(slot, {"type": "opponent_back"})
+
+    def keyframe(self):
+        return self.state.snapshot(max(0.0, self.remaining), time.monotonic())
+
+    def handle_message(self, conn, msg, now):
+        if msg.get("type") == "input":
+            inp = msg.get("keys", {})
+            self.inputs[conn.slot]["up"] = bool(inp.get("up", False))
+            self.inputs[conn.slot]["down"] = bool(inp.get("down", False))
+        elif msg.get("type") == "bye":
+            print(f"[Server] Partida {self.id}: cliente pediu para sair: {conn.addr}")
+            # Saída explícita: avisa o outro cliente e encerra a partida imediatamente
+            self.notify_other(conn.slot, {"type": "opponent_left"})
+            self.finish(now, 0.0)
+
+    # Um passo da partida; devolve [(conexão, erro)] das que falharam no envio
+    def tick(self, now):
+        state = self.state
+        dt = now - self.last_time
+        self.last_time = now
+
+        if state.paused and not state.game_over:
+            state.paused_time += dt
+        elapsed = now - state.game_started_at - state.paused_time
+        self.remaining = self.geo.game_time - elapsed
+        if self.remaining <= 0 and not state.game_over:
+            state.game_over = True
 
-def paddle_rect(x_left, y_top):
-    return (x_left, y_top, PADDLE_W, PADDLE_H)
+        if self.grace_expired(now):
+            return []
 
-def aabb_overlap(ax, ay, aw, ah, bx, by, bw, bh):
-    return (ax < bx + bw and ax + aw > bx and ay < by + bh and ay + ah > by)
+        state.paused = PAUSE_ON_DISCONNECT and any(t is not None for t in self.lost_at)
+
+        # -------- Atualizar jogo --------
+        if not state.game_over and not state.paused:
+            step_physics(state, self.inputs, dt, self.geo)
+
+        # -------- Broadcast do estado --------
+        # Cada cliente recebe na sua própria taxa; no fim de jogo todos recebem o estado final
+        failed = []
+        state.tick += 1
+        snap = state.snapshot(self.remaining if not state.game_over else 0, time.monotonic())
+        for c in self.conns:
+            if c is None:
+                continue
+            try:
+                c.link.adapt(now, c.latency)
+                if state.game_over:
+                    c.link.queue(c.link.shape_snapshot(snap))
+                else:
+                    c.link.offer_snapshot(snap, now)
+                c.link.flush()
+            except Exception as e:
+                failed.append((c, e))
+
+        if state.game_over:
+            self.finish(now, GAME_OVER_COOLDOWN)
+        return failed
+
+    def grace_expired(self, now):
+        for slot in (0, 1):
+            if self.lost_at[slot] is not None and now - self.lost_at[slot] > RECONNECT_GRACE_SECONDS:
+                print(f"[Server] Partida {self.id}: player {slot + 1} não voltou a tempo. Encerrando partida.")
+                self.notify_other(slot, {"type": "opponent_left"})
+                self.finish(now, 0.0)
+                return True
+        return False
+
+    def metrics(self):
+        players = {}
+        for i, c in enumerate(self.conns, start=1):
+            players[f"p{i}"] = None if c is None else {**c.latency.metrics(), **c.link.metrics()}
+        return {"id": self.id, "mode": self.mode, "profile": self.geo.name, "tick": self.state.tick,
+                "started": self.started, "players": players}
+
+
+class RollbackMatch(Match):
+    # Modo rollback: os clientes simulam a partida (mesma semente, passo fixo) e o
+    # servidor só valida e repassa os inputs, guardando o log para quem reconectar
+    mode = MODE_ROLLBACK
+
+    def __init__(self, match_id, now, geo):
+        super().__init__(match_id, now, geo)
+        self.total_frames = geo.game_time * geo.fps
+        self.input_log = [[], []]  # inputs aceitos por vaga, indexados por frame
+        self.checksums = {}        # frame -> [crc p1, crc p2]
+        self.checksum_done = -1    # último frame já comparado entre os dois
+        self.desyncs = 0
+        self.invalid_inputs = 0
+        self.failed = []           # conexões a derrubar, devolvidas no próximo tick
+
+    def start_message(self):
+        return {
+            "type": "match_start",
+            "mode": self.mode,
+            "seed": self.seed,
+            "input_delay": ROLLBACK_INPUT_DELAY,
+        }
+
+    # Quem volta reconstrói a partida do zero a partir da semente e do log
+    def keyframe(self):
+        return {"type": "input_log", "seed": self.seed, "input_delay": ROLLBACK_INPUT_DELAY,
+                "inputs": self.input_log}
+
+    def handle_message(self, conn, msg, now):
+        if msg.get("type") == "input_frame":
+            self.on_input(conn, msg, now)
+        elif msg.get("type") == "checksum":
+            self.on_checksum(conn, msg)
+        else:
+            super().handle_message(conn, msg, now)
+
+    def on_input(self, conn, msg, now):
+        log = self.input_log[conn.slot]
+        frame = msg.get("frame")
+        bits = msg.get("keys")
+        if isinstance(frame, int) and frame < len(log):
+            return  # repetido
+        # Sequência contínua, valor válido e sem adiantar o relógio da partida (anti speed hack)
+        max_frame = (now - self.state.game_started_at) * self.geo.fps + ROLLBACK_INPUT_DELAY + ROLLBACK_INPUT_SLACK
+        if (not isinstance(frame, int) or not isinstance(bits, int) or not 0 <= bits <= 3
+                or frame != len(log) or frame >= self.total_frames or frame > max_frame):
+            # Sem esse frame o log teria um buraco: derruba a conexão, e se o cliente
+            # reconectar ele retoma a partir do log aceito até aqui
+            self.invalid_inputs += 1
+            print(f"[Server] Partida {self.id}: input inválido do player {conn.slot + 1}: {msg}")
+            self.failed.append((conn, ConnectionError("input inválido")))
+            return
+        log.append(bits)
+        self.relay(1 - conn.slot, [(frame, bits)])
+
+    # Repassa inputs aceitos para a vaga `slot`; se ela estiver vazia, ficam só no log
+    # e vão no input_log quando o jogador voltar
+    def relay(self, slot, frames):
+        other = self.conns[slot]
+        if other is None or not frames:
+            return
+        try:
+            for frame, bits in frames:
+                other.link.queue({"type": "input_frame", "frame": frame, "keys": bits})
+            other.link.flush()
+        except Exception as e:
+            self.failed.append((other, e))
+
+    # Sem pausa na queda: a vaga vazia joga com input neutro, acompanhando o outro jogador
+    def fill_lost_slots(self):
+        for slot in (0, 1):
+            if self.lost_at[slot] is None:
+                continue
+            log = self.input_log[slot]
+            target = min(len(self.input_log[1 - slot]), self.total_frames)
+            filled = []
+            while len(log) < target:
+                filled.append((len(log), 0))
+                log.append(0)
+            self.relay(1 - slot, filled)
+
+    def on_checksum(self, conn, msg):
+        frame = msg.get("frame")
+        value = msg.get("value")
+        # Frames já comparados podem ser reenviados por quem retomou a partir do log
+        if (not isinstance(frame, int) or not isinstance(value, int) or isinstance(value, bool)
+                or frame <= self.checksum_done):
+            return
+        entry = self.checksums.setdefault(frame, [None, None])
+        entry[conn.slot] = value
+        if None in entry:
+            return
+        self.checksum_done = frame
+        for f in [f for f in self.checksums if f <= frame]:
+            del self.checksums[f]
+        if entry[0] != entry[1]:
+            self.desyncs += 1
+            print(f"[Server] Partida {self.id}: dessincronização no frame {frame}")
+            for c in self.conns:
+                if c is not None:
+                    try:
+                        c.send({"type": "desync", "frame": frame})
+                    except Exception:
+                        pass
+
+    def tick(self, now):
+        failed, self.failed = self.failed, []
+        if self.grace_expired(now):
+            return failed
+        if not PAUSE_ON_DISCONNECT:
+            self.fill_lost_slots()
+        self.state.tick = min(len(log) for log in self.input_log)
+        self.remaining = (self.total_frames - self.state.tick) / self.geo.fps
+        if self.state.tick >= self.total_frames:
+            self.finish(now, GAME_OVER_COOLDOWN)
+        return failed
+
+    def metrics(self):
+        m = super().metrics()
+        m["frames"] = [len(log) for log in self.input_log]
+        m["invalid_inputs"] = self.invalid_inputs
+        m["desyncs"] = self.desyncs
+        return m
+
+# Exporta as métricas de rede (console e, opcionalmente, arquivo JSON Lines)
+def export_metrics(path, matches, pending, handshakes):
+    record = {
+        "ts": time.time(),
+        "pending": pending,
+        "handshake": {
+            "count": len(handshakes),
+            "avg_ms": round(sum(handshakes) / len(handshakes) * 1000, 2) if handshakes else None,
+            "max_ms": round(max(handshakes) * 1000, 2) if handshakes else None,
+        },
+        "matches": [m.metrics() for m in matches],
+    }
+    hs = record["handshake"]
+    print(f"[Server] partidas={len(matches)} pendentes={pending} "
+          f"handshake avg={hs['avg_ms']}ms max={hs['max_ms']}ms (últimos {hs['count']})")
+    for m in record["matches"]:
+        parts = []
+        for pid, p in m["players"].items():
+            if p is None:
+                parts.append(f"{pid} desconectado")
+                continue
+            parts.append(f"{pid} rtt={p['rtt_ms']}ms jitter={p['rtt_var_ms']}ms offset={p['offset_ms']}ms "
+                         f"snap={p['snapshot_hz']}Hz detail={p['detail']} fila={p['queue_bytes']}B")
+        extra = ""
+        if m["mode"] == MODE_ROLLBACK:
+            extra = f" frames={m['frames']} inválidos={m['invalid_inputs']} dessincs={m['desyncs']}"
+        print(f"[Server]   partida {m['id']} ({m['profile']}, {m['mode']}) tick={m['tick']}{extra} "
+              + " | ".join(parts))
+    if path:
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        except OSError as e:
+            print(f"[Server] Falha ao exportar métricas: {e}")
 
 # --------- Servidor ---------
 def main():
     parser = argparse.ArgumentParser(description="Hockey I - Servidor")
     parser.add_argument("--host", default="0.0.0.0", help="Endereço de escuta (default: 0.0.0.0)")
     parser.add_argument("--port", type=int, default=PORT, help=f"Porta TCP (default: {PORT})")
+    parser.add_argument("--metrics", default=None,
+                        help="Arquivo JSON Lines para exportar métricas de rede (opcional)")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=sorted(PROFILES),
+                        help=f"Perfil de regras padrão das partidas (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--mode", default=DEFAULT_MODE, choices=(MODE_SERVER, MODE_ROLLBACK),
+                        help=f"Modo de rede padrão das partidas (default: {DEFAULT_MODE})")
     args = parser.parse_args()
 
+    # Perfis validados e pré-calculados uma vez; partidas só referenciam os objetos prontos
+    try:
+        profiles = load_profiles()
+    except ValueError as e:
+        print(f"[Server] {e}")
+        return
+
     listen_host = args.host
     listen_port = args.port
 
@@ -85,382 +404,204 @@ def main():
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind((listen_host, listen_port))
-    server.listen(2)
-    server.settimeout(0.5)
-
-    clients = []
-    buffers = {}
-    inputs = {}
-
-    print("[Server] Aguardando jogadores...")
-
-    # Aceita até 2 jogadores e envia hello imediatamente ao conectar
-    try:
-        while len(clients) < 2:
-            try:
-                conn, addr = server.accept()  # agora com timeout
-            except socket.timeout:
-                continue  # volta pro topo do while, permitindo Ctrl+C
-            # reduzir latência
-            try:
-                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            except Exception:
-                pass
-            conn.setblocking(False)
-            clients.append(conn)
-            buffers[conn] = bytearray()
-            inputs[conn] = {"up": False, "down": False}
-
-            player_id = len(clients)  # 1 ou 2
-            print(f"[Server] Cliente conectado: {addr} -> player {player_id} (total {len(clients)}/2)")
-
-            send_json(conn, {
+    server.listen(16)
+    server.setblocking(False)
+
+    # Tudo roda num único loop com select: aceitar, handshake, partidas e cooldown nunca bloqueiam
+    conns = {}      # socket -> Connection (inclusive as que ainda estão no handshake)
+    matches = []
+    handshakes = deque(maxlen=100)  # latência accept -> hello/resumed enviado (s)
+    next_match_id = 1
+    last_metrics = time.monotonic()
+
+    def drop_conn(conn, reason, now):
+        conns.pop(conn.sock, None)
+        conn.close()
+        m = conn.match
+        if m is None or m.conns[conn.slot] is not conn:
+            return
+        if not m.started:
+            # Ainda no lobby: não há partida a preservar
+            print(f"[Server] Partida {m.id}: jogador saiu do lobby ({reason})")
+            m.conns[conn.slot] = None
+            m.finish(now, 0.0)
+        elif m.close_at is None:
+            m.player_lost(conn.slot, reason, now)
+        else:
+            m.conns[conn.slot] = None
+
+    def handshake(conn, msg, now):
+        nonlocal next_match_id
+        if msg.get("type") == "join":
+            geo = profiles.get(msg.get("profile") or args.profile)
+            mode = msg.get("mode") or args.mode
+            reason = None
+            if geo is None:
+                reason = f"perfil desconhecido: {msg.get('profile')}"
+            elif mode not in (MODE_SERVER, MODE_ROLLBACK):
+                reason = f"modo desconhecido: {mode}"
+            if reason:
+                try:
+                    conn.send({"type": "busy", "reason": reason})
+                except Exception:
+                    pass
+                conns.pop(conn.sock, None)
+                conn.close()
+                return
+            m = next((m for m in matches if m.is_open(geo, mode)), None)
+            if m is None:
+                match_cls = RollbackMatch if mode == MODE_ROLLBACK else Match
+                m = match_cls(next_match_id, now, geo)
+                next_match_id += 1
+                matches.append(m)
+            slot = 0 if m.conns[0] is None else 1
+            m.attach(slot, conn, now)
+            print(f"[Server] Cliente conectado: {conn.addr} -> partida {m.id} ({geo.name}, {mode}), player {slot + 1}")
+            conn.send({
                 "type": "hello",
-                "player": player_id,
-                "width": WIDTH,
-                "height": HEIGHT,
-                "waiting": len(clients) < 2
+                "player": slot + 1,
+                "width": geo.width,
+                "height": geo.height,
+                "rules": geo.to_dict(),
+                "mode": mode,
+                "waiting": slot == 0,
+                "token": m.tokens[slot],
+                "grace": RECONNECT_GRACE_SECONDS,
             })
-    except KeyboardInterrupt:
-        print("\n[Server] Interrompido por Ctrl+C. Encerrando...")
-        for c in clients:
-            try: c.close()
-            except: pass
-        server.close()
-        return
-
-    # Ambos conectados: avisa início de partida
-    for c in clients:
+            handshakes.append(time.monotonic() - conn.accepted_at)
+            if m.conns[1] is not None:
+                m.start(now)
+            return
+
+        if msg.get("type") == "resume":
+            token = msg.get("token")
+            for m in matches:
+                if m.started and m.close_at is None and token and token in m.tokens:
+                    slot = m.tokens.index(token)
+                    old = m.conns[slot]
+                    if old is not None:
+                        # A conexão antiga ainda não tinha caído do nosso lado: a nova prevalece
+                        conns.pop(old.sock, None)
+                        old.close()
+                    print(f"[Server] Partida {m.id}: player {slot + 1} reconectou: {conn.addr}")
+                    m.resume(slot, conn, now)
+                    handshakes.append(time.monotonic() - conn.accepted_at)
+                    return
+
+        # Mensagem inesperada ou token inválido
         try:
-            send_json(c, {"type": "match_start"})
-        except:
+            conn.send({"type": "busy"})
+        except Exception:
             pass
+        conns.pop(conn.sock, None)
+        conn.close()
 
-    print("[Server] Dois jogadores conectados. Iniciando jogo!")
-
-    state = GameState()
-    state.game_started_at = time.monotonic()
-    last_time = time.monotonic()
-
-    # --- Geometria das goleiras ---
-    # Boca do gol centralizada verticalmente
-    GOAL_Y0 = HEIGHT // 2 - GOAL_H // 2
-    GOAL_Y1 = HEIGHT // 2 + GOAL_H // 2
-
-    # Linha de gol (frente da goleira) colada às “paredes internas” do rink
-    LEFT_GOAL_X_FRONT = MARGIN + 40
-    RIGHT_GOAL_X_FRONT = WIDTH - MARGIN - 40
-
-    # Fundo da goleira (parede de trás) a GOAL_W de profundidade
-    LEFT_GOAL_X_BACK = LEFT_GOAL_X_FRONT - GOAL_W
-    RIGHT_GOAL_X_BACK = RIGHT_GOAL_X_FRONT + GOAL_W
-
-    POST_T = BALL_SIZE / 2 + 1
-
-    running = True
-    while running:
-        # Cálculo de tempo
-        now = time.monotonic()
-        dt = now - last_time
-        last_time = now
-
-        elapsed = now - state.game_started_at
-        remaining = GAME_TIME_SECONDS - elapsed
-        if remaining <= 0 and not state.game_over:
-            state.game_over = True
-
-        # -------- Receber entradas --------
-        # (lidos, escritos, excepcionais) - só precisamos dos lidos
-        rlist, _, _ = select.select(clients, [], [], 0)
-        for sock in rlist:
-            try:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    raise ConnectionError("Cliente desconectou")
-                buffers[sock] += chunk
-                for msg in recv_frames(buffers[sock]):
-                    if msg.get("type") == "input":
-                        inp = msg.get("keys", {})
-                        inputs[sock]["up"] = bool(inp.get("up", False))
-                        inputs[sock]["down"] = bool(inp.get("down", False))
-                    elif msg.get("type") == "bye":
-                        print(f"[Server] Cliente pediu para sair: {sock.getpeername()}")
-                        # Avisa o outro cliente (se existir)
-                        for oc in clients:
-                            # Se não for o socket atual
-                            if oc is not sock:
-                                try:
-                                    send_json(oc, {"type": "opponent_left"})
-                                except Exception as e:
-                                    print(f"[Servidor] Erro ao tentar avisar jogador que o outro saiu: {e}")
-                        # Encerra a partida imediatamente
-                        running = False
-                        break
-            except Exception as e:
-                print(f"[Server] Erro/saída do cliente: {e}")
-                running = False
-
-        if not running:
-            break
-
-        # -------- Atualizar jogo --------
-        if not state.game_over:
-            # Mover paddles
-            dy1 = (PADDLE_SPEED * dt) * (-1 if inputs[clients[0]]["up"] else (1 if inputs[clients[0]]["down"] else 0))
-            dy2 = (PADDLE_SPEED * dt) * (-1 if inputs[clients[1]]["up"] else (1 if inputs[clients[1]]["down"] else 0))
-            state.p1_y = clamp(state.p1_y + dy1, MARGIN, HEIGHT - MARGIN - PADDLE_H)
-            state.p2_y = clamp(state.p2_y + dy2, MARGIN, HEIGHT - MARGIN - PADDLE_H)
-
-            # Mover bola
-            prev_x = state.ball_x
-            prev_y = state.ball_y
-
-            state.ball_x += state.ball_vx * dt
-            state.ball_y += state.ball_vy * dt
-
-            # Colisão com teto/solo
-            top = MARGIN - 5
-            bottom = HEIGHT - MARGIN + 5
-            if state.ball_y - BALL_SIZE/2 < top:
-                state.ball_y = top + BALL_SIZE/2
-                state.ball_vy *= -1
-            elif state.ball_y + BALL_SIZE/2 > bottom:
-                state.ball_y = bottom - BALL_SIZE/2
-                state.ball_vy *= -1
-
-            # Colisão com paddles
-            p1x = MARGIN + 80
-            p2x = WIDTH - MARGIN - PADDLE_W - 80
-
-            # Recalcula retângulo da bola antes de cada checagem
-            ball_rect = (
-                state.ball_x - BALL_SIZE/2,
-                state.ball_y - BALL_SIZE/2,
-                BALL_SIZE, BALL_SIZE
-            )
-
-            # ---------------- Paddle 1 (esquerda) ----------------
-            p1_rect = paddle_rect(p1x, state.p1_y)
-            if aabb_overlap(*p1_rect, *ball_rect):
-                # Checa se a colisão é vertical (topo/base) ou lateral (frente/trás)
-                bx, by, bw, bh = ball_rect
-                px, py, pw, ph = p1_rect
-
-                overlap_left = (bx + bw) - px
-                overlap_right = (px + pw) - bx
-                overlap_top = (by + bh) - py
-                overlap_bottom = (py + ph) - by
-
-                min_ox = min(overlap_left, overlap_right)
-                min_oy = min(overlap_top, overlap_bottom)
-
-                r = BALL_SIZE / 2.0
-
-                if min_oy < min_ox:
-                    # --- Colisão no TOPO/BASE do paddle: reflete vy e reposiciona fora ---
-                    if overlap_top < overlap_bottom:
-                        # Bateu no topo do paddle
-                        state.ball_y = py - r - 0.1
-                        state.ball_vy = -abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else -(BALL_SPEED * 0.6)
-                    else:
-                        # Bateu na base do paddle
-                        state.ball_y = py + ph + r + 0.1
-                        state.ball_vy =  abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else  (BALL_SPEED * 0.6)
-
-                    # Pequeno empurrão horizontal baseado na altura do impacto (mantém sensação de controle)
-                    rel = ((state.ball_y) - (state.p1_y + PADDLE_H/2)) / (PADDLE_H/2)
-                    rel = clamp(rel, -1, 1)
-                    state.ball_vx = clamp(state.ball_vx + rel * (BALL_SPEED_INC_ON_HIT * 0.2), -BALL_SPEED_MAX, BALL_SPEED_MAX)
-
-                else:
-                    # --- Colisão LATERAL (frente/trás)
-                    if state.ball_vx < 0:
-                        # Frente (bola indo para a esquerda)
-                        rel = ((state.ball_y) - (state.p1_y + PADDLE_H/2)) / (PADDLE_H/2)
-                        rel = clamp(rel, -1, 1)
-                        ang = math.radians(BALL_ANGLE_MAX_DEG) * rel
-                        speed = min(math.hypot(state.ball_vx, state.ball_vy) + BALL_SPEED_INC_ON_HIT, BALL_SPEED_MAX)
-                        state.ball_vx =  speed * math.cos(ang)
-                        state.ball_vy =  speed * math.sin(ang)
-                        state.ball_x = p1x + PADDLE_W + r + 1
-                    else:
-                        # Por trás (bola indo para a direita)
-                        rel = ((state.ball_y) - (state.p1_y + PADDLE_H/2)) / (PADDLE_H/2)
-                        rel = clamp(rel, -1, 1)
-                        ang = math.radians(BALL_ANGLE_MAX_DEG) * rel
-                        speed = min(math.hypot(state.ball_vx, state.ball_vy) + BALL_SPEED_INC_ON_HIT, BALL_SPEED_MAX)
-                        state.ball_vx = -speed * math.cos(ang)
-                        state.ball_vy =  speed * math.sin(ang)
-                        state.ball_x = p1x - r - 1
-
-            # Recalcula ball_rect novamente (posições podem ter mudado)
-            ball_rect = (
-                state.ball_x - BALL_SIZE/2,
-                state.ball_y - BALL_SIZE/2,
-                BALL_SIZE, BALL_SIZE
-            )
-
-            # ---------------- Paddle 2 (direita) ----------------
-            p2_rect = paddle_rect(p2x, state.p2_y)
-            if aabb_overlap(*p2_rect, *ball_rect):
-                bx, by, bw, bh = ball_rect
-                px, py, pw, ph = p2_rect
-
-                overlap_left = (bx + bw) - px
-                overlap_right = (px + pw) - bx
-                overlap_top = (by + bh) - py
-                overlap_bottom = (py + ph) - by
-
-                min_ox = min(overlap_left, overlap_right)
-                min_oy = min(overlap_top, overlap_bottom)
-
-                r = BALL_SIZE / 2.0
-
-                if min_oy < min_ox:
-                    # --- Colisão no TOPO/BASE do paddle ---
-                    if overlap_top < overlap_bottom:
-                        state.ball_y = py - r - 0.1
-                        state.ball_vy = -abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else -(BALL_SPEED * 0.6)
-                    else:
-                        state.ball_y = py + ph + r + 0.1
-                        state.ball_vy =  abs(state.ball_vy) if abs(state.ball_vy) > 1e-6 else  (BALL_SPEED * 0.6)
-
-                    rel = ((state.ball_y) - (state.p2_y + PADDLE_H/2)) / (PADDLE_H/2)
-                    rel = clamp(rel, -1, 1)
-                    state.ball_vx = clamp(state.ball_vx + rel * (BALL_SPEED_INC_ON_HIT * 0.2), -BALL_SPEED_MAX, BALL_SPEED_MAX)
-
+    def read_from(conn, now):
+        try:
+            chunk = conn.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Cliente desconectou")
+            conn.buffer += chunk
+            conn.last_heard = now
+            for msg in recv_frames(conn.buffer):
+                if msg.get("type") == "ping":
+                    conn.link.queue(make_pong(msg, now))
+                elif msg.get("type") == "pong":
+                    conn.latency.on_pong(msg, now)
+                elif conn.match is None:
+                    handshake(conn, msg, now)
+                    if conn.sock not in conns:
+                        return
                 else:
-                    # --- Colisão LATERAL (frente/trás) ---
-                    if state.ball_vx > 0:
-                        # Frente (bola indo para a direita)
-                        rel = ((state.ball_y) - (state.p2_y + PADDLE_H/2)) / (PADDLE_H/2)
-                        rel = clamp(rel, -1, 1)
-                        ang = math.radians(BALL_ANGLE_MAX_DEG) * rel
-                        speed = min(math.hypot(state.ball_vx, state.ball_vy) + BALL_SPEED_INC_ON_HIT, BALL_SPEED_MAX)
-                        state.ball_vx = -speed * math.cos(ang)
-                        state.ball_vy =  speed * math.sin(ang)
-                        state.ball_x = p2x - r - 1
-                    else:
-                        # Por trás (bola indo para a esquerda)
-                        rel = ((state.ball_y) - (state.p2_y + PADDLE_H/2)) / (PADDLE_H/2)
-                        rel = clamp(rel, -1, 1)
-                        ang = math.radians(BALL_ANGLE_MAX_DEG) * rel
-                        speed = min(math.hypot(state.ball_vx, state.ball_vy) + BALL_SPEED_INC_ON_HIT, BALL_SPEED_MAX)
-                        state.ball_vx =  speed * math.cos(ang)
-                        state.ball_vy =  speed * math.sin(ang)
-                        state.ball_x = p2x + pw + r + 1
-
-            # --- GOLS por CRUZAMENTO e REBATES nas goleiras ---
-            r = BALL_SIZE / 2
-
-            bx_left_prev = prev_x - r
-            bx_right_prev = prev_x + r
-            bx_left_cur = state.ball_x - r
-            bx_right_cur = state.ball_x + r
-
-            by_prev_top = prev_y - r # “topo” da bola no frame anterior
-            by_cur_top = state.ball_y - r
-            by_prev_bot = prev_y + r # “base” da bola no frame anterior
-            by_cur_bot = state.ball_y + r
-
-            scored = False
-
-            # 1) Gol à ESQUERDA: cruzou a linha pela frente e dentro da boca
-            if state.ball_vx < 0 and bx_left_prev > LEFT_GOAL_X_FRONT and bx_left_cur <= LEFT_GOAL_X_FRONT:
-                denom = (bx_left_prev - bx_left_cur) or 1e-9
-                t = (bx_left_prev - LEFT_GOAL_X_FRONT) / denom
-                y_cross = prev_y + t * (state.ball_y - prev_y)
-                if GOAL_Y0 <= y_cross <= GOAL_Y1:
-                    state.score2 += 1
-                    state.reset_ball(to_left=False)
-                    scored = True
-
-            # 2) Gol à DIREITA: cruzou a linha pela frente e dentro da boca
-            elif state.ball_vx > 0 and bx_right_prev < RIGHT_GOAL_X_FRONT and bx_right_cur >= RIGHT_GOAL_X_FRONT:
-                denom = (bx_right_cur - bx_right_prev) or 1e-9
-                t = (RIGHT_GOAL_X_FRONT - bx_right_prev) / denom
-                y_cross = prev_y + t * (state.ball_y - prev_y)
-                if GOAL_Y0 <= y_cross <= GOAL_Y1:
-                    state.score1 += 1
-                    state.reset_ball(to_left=True)
-                    scored = True
-
-            if not scored:
-                # 3) Fundo da rede: rebate na parede de trás se entrar atrás do gol
-                if bx_left_cur <= LEFT_GOAL_X_BACK - 30:
-                    state.ball_vx = abs(state.ball_vx)
-                    state.ball_x  = LEFT_GOAL_X_BACK - 30 + r + 0.1
-
-                if bx_right_cur >= RIGHT_GOAL_X_BACK + 30:
-                    state.ball_vx = -abs(state.ball_vx)
-                    state.ball_x  = RIGHT_GOAL_X_BACK + 30 - r - 0.1
-
-                # 3b) Boca do gol: rebate quando a bola vem por trás (sem contar gol)
-                # Esquerda: bola está DENTRO (x < LEFT_GOAL_X_FRONT) e cruza o plano frontal indo para fora (→)
-                if state.ball_vx > 0 and bx_left_prev < LEFT_GOAL_X_FRONT and bx_left_cur >= LEFT_GOAL_X_FRONT:
-                    denom = (bx_left_cur - bx_left_prev) or 1e-9
-                    t = (LEFT_GOAL_X_FRONT - bx_left_prev) / denom
-                    y_cross = prev_y + t * (state.ball_y - prev_y)
-                    if GOAL_Y0 <= y_cross <= GOAL_Y1:
-                        state.ball_vx = -abs(state.ball_vx)
-                        state.ball_x  = LEFT_GOAL_X_FRONT - r - 0.1
-
-                # Direita: bola está DENTRO (x > RIGHT_GOAL_X_FRONT) e cruza o plano frontal indo para fora (←)
-                if state.ball_vx < 0 and bx_right_prev > RIGHT_GOAL_X_FRONT and bx_right_cur <= RIGHT_GOAL_X_FRONT:
-                    denom = (bx_right_prev - bx_right_cur) or 1e-9
-                    t = (bx_right_prev - RIGHT_GOAL_X_FRONT) / denom
-                    y_cross = prev_y + t * (state.ball_y - prev_y)
-                    if GOAL_Y0 <= y_cross <= GOAL_Y1:
-                        state.ball_vx =  abs(state.ball_vx)
-                        state.ball_x  = RIGHT_GOAL_X_FRONT + r + 0.1
-
-
-                # 4) Travessão e base por CRUZAMENTO VERTICAL dentro da profundidade do gol
-                # Faixas finas centradas na linha de gol da frente (boca)
-                left_front_band_prev = (LEFT_GOAL_X_FRONT - POST_T) <= prev_x <= (LEFT_GOAL_X_FRONT + POST_T)
-                left_front_band_cur = (LEFT_GOAL_X_FRONT - POST_T) <= state.ball_x <= (LEFT_GOAL_X_FRONT + POST_T)
-                right_front_band_prev = (RIGHT_GOAL_X_FRONT - POST_T) <= prev_x <= (RIGHT_GOAL_X_FRONT + POST_T)
-                right_front_band_cur = (RIGHT_GOAL_X_FRONT - POST_T) <= state.ball_x <= (RIGHT_GOAL_X_FRONT + POST_T)
-
-                near_any_front = (left_front_band_prev or left_front_band_cur or
-                                right_front_band_prev or right_front_band_cur)
-
-                if near_any_front:
-                    # Bate no TRAVESSÃO (topo da boca) só se cruzar vindo de baixo pra cima
-                    if state.ball_vy < 0 and by_prev_top > GOAL_Y0 and by_cur_top <= GOAL_Y0:
-                        state.ball_y = GOAL_Y0 + r + 0.1
-                        state.ball_vy = abs(state.ball_vy)
-
-                    # Bate na BASE da boca só se cruzar vindo de cima pra baixo
-                    elif state.ball_vy > 0 and by_prev_bot < GOAL_Y1 and by_cur_bot >= GOAL_Y1:
-                        state.ball_y = GOAL_Y1 - r - 0.1
-                        state.ball_vy = -abs(state.ball_vy)
+                    conn.match.handle_message(conn, msg, now)
+        except Exception as e:
+            print(f"[Server] Erro/saída do cliente: {e}")
+            drop_conn(conn, e, now)
 
-        # -------- Broadcast do estado --------
-        snap = state.snapshot(remaining if not state.game_over else 0)
-        for c in clients:
-            try:
-                send_json(c, snap)
-            except Exception as e:
-                print(f"[Server] Falha ao enviar para cliente: {e}")
-                running = False
-
-        if state.game_over or not running:
-            time.sleep(7.0)
-            break
+    print("[Server] Aguardando jogadores...")
 
-        # Tick ~FPS
-        frame_budget = 1.0 / FPS
-        spent = time.monotonic() - now
-        if spent < frame_budget:
-            time.sleep(frame_budget - spent)
+    try:
+        while True:
+            # Dorme no select só até o próximo tick (ou encerramento) de alguma partida
+            now = time.monotonic()
+            timeout = 0.05
+            for m in matches:
+                wake_at = m.close_at if m.close_at is not None else m.next_tick_at
+                if wake_at is not None:
+                    timeout = min(timeout, max(0.0, wake_at - now))
+            wsocks = [s for s, c in conns.items() if c.link.outbuf]
+            rlist, wlist, _ = select.select([server] + list(conns), wsocks, [], timeout)
+            now = time.monotonic()
+
+            # -------- Entradas --------
+            for sock in rlist:
+                if sock is server:
+                    while True:
+                        try:
+                            s, addr = server.accept()
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        setup_conn(s)
+                        conns[s] = Connection(s, addr, now)
+                    continue
+                conn = conns.get(sock)
+                if conn is not None:
+                    read_from(conn, now)
+
+            for sock in wlist:
+                conn = conns.get(sock)
+                if conn is None:
+                    continue
+                try:
+                    conn.link.flush()
+                except Exception as e:
+                    drop_conn(conn, e, now)
+
+            # -------- Conexões silenciosas (inclusive handshake que nunca chegou) --------
+            for conn in list(conns.values()):
+                if now - conn.last_heard > CONNECTION_TIMEOUT:
+                    drop_conn(conn, "sem resposta", now)
+
+            # -------- Partidas --------
+            for m in list(matches):
+                if m.close_at is None and m.next_tick_at is not None and now >= m.next_tick_at:
+                    for conn, e in m.tick(now):
+                        print(f"[Server] Falha ao enviar para cliente: {e}")
+                        drop_conn(conn, e, now)
+                    for conn in list(m.conns):
+                        if conn is not None and conn.latency.ping_due(now):
+                            try:
+                                conn.link.queue(conn.latency.make_ping(time.monotonic()))
+                            except Exception as e:
+                                print(f"[Server] Falha ao enviar para cliente: {e}")
+                                drop_conn(conn, e, now)
+                    m.next_tick_at += m.geo.dt
+                    if m.next_tick_at < now - m.geo.dt:
+                        m.next_tick_at = now + m.geo.dt  # atrasou demais: não tenta recuperar
+
+                if m.close_at is not None and now >= m.close_at:
+                    for conn in m.conns:
+                        if conn is not None:
+                            try:
+                                conn.link.flush()
+                            except Exception:
+                                pass
+                            conns.pop(conn.sock, None)
+                            conn.close()
+                    matches.remove(m)
+                    print(f"[Server] Partida {m.id} encerrada.")
+
+            # -------- Métricas --------
+            if now - last_metrics >= METRICS_INTERVAL:
+                last_metrics = now
+                pending = sum(1 for c in conns.values() if c.match is None)
+                export_metrics(args.metrics, matches, pending, handshakes)
+    except KeyboardInterrupt:
+        print("\n[Server] Interrompido por Ctrl+C. Encerrando...")
 
     print("[Server] Encerrando conexões.")
-    for c in clients:
-        try:
-            c.close()
-        except:
-            pass
+    for conn in list(conns.values()):
+        conn.close()
     server.close()
 
 if __name__ == "__main__":